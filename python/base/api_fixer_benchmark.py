@@ -0,0 +1,105 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+"""Compares the HTML-safe JSON encoder in base.api_fixer with its predecessor.
+
+Checks that both produce byte-identical output before timing them, for
+payloads from a single CSP report up to a large room listing.
+
+Run from this directory with the App Engine SDK on the PYTHONPATH:
+
+  python api_fixer_benchmark.py [iterations]
+"""
+
+import json
+import sys
+import timeit
+
+try:
+  import dev_appserver
+  dev_appserver.fix_sys_path()
+except ImportError:
+  pass
+
+import api_fixer
+
+_DEFAULT_ITERATIONS = 200
+
+
+class _LegacyJsonEncoderForHtml(json.JSONEncoder):
+  """_JsonEncoderForHtml as it was before the output was escaped once."""
+
+  def encode(self, o):
+    chunks = self.iterencode(o, _one_shot=True)
+    if not isinstance(chunks, (list, tuple)):
+      chunks = list(chunks)
+    return ''.join(chunks)
+
+  def iterencode(self, o, _one_shot=False):
+    chunks = super(_LegacyJsonEncoderForHtml, self).iterencode(o, _one_shot)
+    for chunk in chunks:
+      for (character, replacement) in (
+          api_fixer._JSON_CHARACTER_REPLACEMENT_MAPPING):
+        chunk = chunk.replace(character, replacement)
+      yield chunk
+
+
+def _CspReport():
+  return {'csp-report': {
+      'document-uri': 'https://musicalforest.withgoogle.com/?a=1&b=2',
+      'referrer': '',
+      'violated-directive': 'script-src',
+      'effective-directive': 'script-src',
+      'original-policy': 'object-src \'none\'; script-src \'nonce-abc\'',
+      'blocked-uri': 'https://evil.example.com/<script>',
+      'source-file': 'https://musicalforest.withgoogle.com/js/main.js',
+      'line-number': 42,
+      'status-code': 200,
+  }}
+
+
+def _RoomListing(rooms):
+  return {'rooms': [{'id': 'room-%d' % i,
+                     'name': u'Forest <%d> & friends' % i,
+                     'host': 'rooms-%d.example.com' % (i % 7),
+                     'players': i % 12,
+                     'capacity': 12,
+                     'open': bool(i % 3)}
+                    for i in range(rooms)]}
+
+
+_PAYLOADS = [
+    ('CSP report', _CspReport()),
+    ('10 rooms', _RoomListing(10)),
+    ('100 rooms', _RoomListing(100)),
+    ('1000 rooms', _RoomListing(1000)),
+]
+
+
+def main(argv):
+  iterations = int(argv[1]) if len(argv) > 1 else _DEFAULT_ITERATIONS
+  legacy = _LegacyJsonEncoderForHtml()
+  current = api_fixer._JsonEncoderForHtml()
+  print '%-12s %8s %12s %12s' % ('payload', 'bytes', 'legacy us', 'current us')
+  for (name, payload) in _PAYLOADS:
+    expected = legacy.encode(payload)
+    assert current.encode(payload) == expected, name
+    assert ''.join(current.iterencode(payload)) == expected, name
+    times = [min(timeit.repeat(lambda: encoder.encode(payload),
+                               number=iterations, repeat=3)) * 1e6 / iterations
+             for encoder in (legacy, current)]
+    print '%-12s %8d %12.1f %12.1f' % (name, len(expected), times[0], times[1])
+
+
+if __name__ == '__main__':
+  main(sys.argv)
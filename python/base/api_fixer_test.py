@@ -13,12 +13,15 @@
 #     limitations under the License.
 """Tests for base.api_fixer."""
 
+import io
 import json
 import pickle
 import unittest2
+import webapp2
 import yaml
 
 import api_fixer
+import constants
 
 
 class BadPickle(object):
@@ -34,6 +37,19 @@ class ApiFixerTest(unittest2.TestCase):
     o = {'foo': '<script>alert(1);</script>'}
     self.assertFalse('<' in json.dumps(o))
 
+  def testJsonEscapingOutput(self):
+    o = {'a&b': ['<', u'>\u2028', 1.5, None, True]}
+    expected = ('{"a\\u0026b": ["\\u003c", "\\u003e\\u2028", 1.5, null, '
+                'true]}')
+    self.assertEqual(expected, json.dumps(o))
+    self.assertEqual(o, json.loads(json.dumps(o)))
+    self.assertEqual('"\\u003c/script\\u003e"', json.dumps('</script>'))
+
+  def testJsonDumpEscapesStreamedOutput(self):
+    stream = io.BytesIO()
+    json.dump({'foo': ['<&>'] * 3}, stream)
+    self.assertEqual(json.dumps({'foo': ['<&>'] * 3}), stream.getvalue())
+
   def testYamlLoading(self):
     unsafe = '!!python/object/apply:os.system ["ls"]'
     try:
@@ -61,6 +77,16 @@ class ApiFixerTest(unittest2.TestCase):
     except Exception:
       self.fail('safe unpickling failed')
 
+  def testCookieDefaults(self):
+    set_cookie = webapp2.Response.set_cookie.im_func
+    self.assertTrue(api_fixer.GetDefaultArgument(set_cookie, 'httponly'))
+    self.assertEqual(not constants.IS_DEV_APPSERVER,
+                     api_fixer.GetDefaultArgument(set_cookie, 'secure'))
+
+    response = webapp2.Response()
+    response.set_cookie('foo', 'bar')
+    self.assertIn('httponly', response.headers['Set-Cookie'].lower())
+
 
 if __name__ == '__main__':
   unittest2.main()
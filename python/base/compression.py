@@ -0,0 +1,102 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+"""Content-Encoding negotiation and compression for response bodies.
+
+gzip is always available.  Brotli is offered too when the brotli module can
+be imported; App Engine does not bundle it, so it must be vendored to be used.
+
+BaseHandler only compresses responses itself when the 'compress_responses' app
+config setting is on.  By default that is left to the App Engine front end,
+which compresses responses on its own and treats Content-Encoding as one of
+the headers it manages.
+
+Bodies which are served many times can be compressed once with Variants(),
+at the highest compression levels, and written with
+BaseHandler.write_variants().
+"""
+
+import zlib
+
+try:
+  import brotli
+except ImportError:
+  brotli = None
+
+GZIP = 'gzip'
+BROTLI = 'br'
+IDENTITY = 'identity'
+
+# Encodings in order of preference, for clients accepting several equally.
+ENCODINGS = [BROTLI, GZIP] if brotli else [GZIP]
+
+# Smaller bodies gain too little to be worth compressing.
+MIN_SIZE = 512
+
+# Compression levels for bodies compressed once, and for each response.
+_GZIP_LEVELS = {True: 9, False: 6}
+_BROTLI_QUALITIES = {True: 11, False: 4}
+
+# zlib writes gzip headers and trailers with this window size.
+_GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+def Negotiate(request):
+  """Returns the encoding to send request's response in, or None."""
+  # An empty header allows identity alone, but webob reads it as accepting
+  # anything.
+  if not request.headers.get('Accept-Encoding'):
+    return None
+  return request.accept_encoding.best_match(ENCODINGS)
+
+
+def Compress(body, encoding, once=False):
+  """Returns body compressed with encoding.
+
+  once selects the highest compression levels, for bodies whose compressed
+  form is kept and reused.
+  """
+  if encoding == BROTLI:
+    return brotli.compress(body, quality=_BROTLI_QUALITIES[once])
+  compressor = zlib.compressobj(_GZIP_LEVELS[once], zlib.DEFLATED,
+                                _GZIP_WBITS)
+  return compressor.compress(body) + compressor.flush()
+
+
+def Decompress(body, encoding):
+  """Returns body, compressed with encoding, as it was before compression."""
+  if encoding == BROTLI:
+    return brotli.decompress(body)
+  return zlib.decompress(body, _GZIP_WBITS)
+
+
+def Variants(body, compress=True):
+  """Returns a dict of body by encoding, with IDENTITY for body itself.
+
+  Without compress, the dict only holds body itself.  It is made only of
+  builtins, so it can be cached in memcache.
+  """
+  variants = {IDENTITY: body}
+  if compress and len(body) >= MIN_SIZE:
+    for encoding in ENCODINGS:
+      variants[encoding] = Compress(body, encoding, once=True)
+  return variants
+
+
+def AddVary(response, header):
+  """Adds header to response's Vary header, unless it is already there."""
+  vary = response.headers.get('Vary')
+  if not vary:
+    response.headers['Vary'] = header
+  elif header.lower() not in [h.strip().lower() for h in vary.split(',')]:
+    response.headers['Vary'] = '%s, %s' % (vary, header)
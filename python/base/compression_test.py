@@ -0,0 +1,71 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+"""Tests for base.compression."""
+
+import unittest2
+import webapp2
+import zlib
+
+import compression
+
+
+class CompressionTest(unittest2.TestCase):
+  """Test cases for base.compression."""
+
+  def _Negotiate(self, accept_encoding=None):
+    headers = {}
+    if accept_encoding is not None:
+      headers['Accept-Encoding'] = accept_encoding
+    return compression.Negotiate(webapp2.Request.blank('/', headers=headers))
+
+  def testNegotiate(self):
+    self.assertIsNone(self._Negotiate())
+    self.assertIsNone(self._Negotiate(''))
+    self.assertIsNone(self._Negotiate('deflate'))
+    self.assertIsNone(self._Negotiate('gzip;q=0'))
+    self.assertEqual(compression.GZIP, self._Negotiate('gzip, deflate'))
+    self.assertEqual(compression.ENCODINGS[0], self._Negotiate('*'))
+
+  def testSmallBodiesAreNotCompressed(self):
+    body = 'x' * (compression.MIN_SIZE - 1)
+    self.assertEqual({compression.IDENTITY: body}, compression.Variants(body))
+
+  def testVariantsAreOnlyCompressedWhenAsked(self):
+    body = 'forest ' * compression.MIN_SIZE
+    self.assertEqual({compression.IDENTITY: body},
+                     compression.Variants(body, compress=False))
+
+  def testVariantsDecompressToBody(self):
+    body = 'forest ' * compression.MIN_SIZE
+    variants = compression.Variants(body)
+    self.assertEqual(set([compression.IDENTITY] + compression.ENCODINGS),
+                     set(variants))
+    self.assertEqual(body, variants[compression.IDENTITY])
+    self.assertEqual(body, zlib.decompress(variants[compression.GZIP],
+                                           16 + zlib.MAX_WBITS))
+    self.assertLess(len(variants[compression.GZIP]), len(body))
+
+  def testAddVary(self):
+    response = webapp2.Response()
+    compression.AddVary(response, 'Accept-Encoding')
+    self.assertEqual('Accept-Encoding', response.headers['Vary'])
+    response.headers['Vary'] = 'X-AppEngine-Country'
+    compression.AddVary(response, 'Accept-Encoding')
+    compression.AddVary(response, 'accept-encoding')
+    self.assertEqual('X-AppEngine-Country, Accept-Encoding',
+                     response.headers['Vary'])
+
+
+if __name__ == '__main__':
+  unittest2.main()
@@ -29,6 +29,16 @@ NONCE_LENGTH = 10
 # using_angular
 DEFAULT_ANGULAR = False
 
+# compress_responses
+DEFAULT_COMPRESS_RESPONSES = False
+
+# jinja2_bytecode_cache
+(NO_BYTECODE_CACHE, MEMCACHE_BYTECODE_CACHE,
+ PRECOMPILED_BYTECODE_CACHE) = range(0, 3)
+
+# rate_limit.RateLimit keys
+(RATE_LIMIT_BY_IP, RATE_LIMIT_BY_COUNTRY) = range(0, 2)
+
 # framing_policy
 (DENY, SAMEORIGIN, PERMIT) = range(0, 3)
 X_FRAME_OPTIONS_VALUES = {DENY: 'DENY', SAMEORIGIN: 'SAMEORIGIN'}
@@ -49,6 +59,10 @@ DEBUG = IS_DEV_APPSERVER
 
 TEMPLATE_DIR = os.path.sep.join([os.path.dirname(__file__), '..', '..'])
 
+# Written by base/template_cache.py at deploy time, read-only when serving.
+PRECOMPILED_TEMPLATE_DIR = os.path.sep.join([os.path.dirname(__file__), '..',
+                                             'template_cache'])
+
 # csp_policy
 DEFAULT_CSP_POLICY = {
     # Disallow Flash, etc.
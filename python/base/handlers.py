@@ -15,29 +15,53 @@
 
 import abc
 import base64
-import django.conf
-import django.template
-import django.template.loader
 import functools
 
 import json
+import math
+import random
+import re
+import threading
+import time
 import webapp2
-from webapp2_extras import jinja2
 
 import api_fixer
+import compression
 import constants
+import microcache
 import models
 import os
+import profiler
+import timing
 import xsrf
 
 from google.appengine.api import memcache
 from google.appengine.api import users
 
 
-# Django initialization.
-django.conf.settings.configure(DEBUG=constants.DEBUG,
-                               TEMPLATE_DEBUG=constants.DEBUG,
-                               TEMPLATE_DIRS=[constants.TEMPLATE_DIR])
+# Template systems are imported on first use, so only the one selected by the
+# 'template' app config setting is ever loaded.  Importing and configuring
+# Django in particular is a noticeable share of an instance's cold start.
+_django_lock = threading.Lock()
+
+
+def _ImportDjango():
+  """Returns the django package, importing and configuring it if necessary."""
+  import django.conf
+  import django.template
+  import django.template.loader
+  with _django_lock:
+    if not django.conf.settings.configured:
+      django.conf.settings.configure(DEBUG=constants.DEBUG,
+                                     TEMPLATE_DEBUG=constants.DEBUG,
+                                     TEMPLATE_DIRS=[constants.TEMPLATE_DIR])
+  return django
+
+
+def _ImportJinja2():
+  """Returns the webapp2_extras.jinja2 module."""
+  from webapp2_extras import jinja2
+  return jinja2
 
 
 # Assorted decorators that can be used inside a webapp2.RequestHandler object
@@ -77,16 +101,80 @@ def xsrf_protected(f):
   return wrapper
 
 
+# Every logged in request needs the XSRF keys, so each instance keeps its own
+# copy of the keyring for _XSRF_KEYRING_TTL seconds rather than asking memcache
+# each time.  Only one thread at a time reloads it, so an instance never sends
+# a burst of memcache gets (or, after an eviction, Datastore transactions) for
+# it.  Together, the two TTLs bound how long an instance can go on without
+# seeing a rotation; models._XSRF_KEY_PROPAGATION_DELAY must exceed their sum.
+_XSRF_KEYRING_TTL = 60
+_XSRF_KEYRING_MEMCACHE_KEY = 'xsrf_keyring'
+_XSRF_KEYRING_MEMCACHE_TTL = 300
+_xsrf_keyring_lock = threading.Lock()
+_xsrf_keyring_cache = {'keyring': None, 'loaded_at': 0}
+_memcache_client = memcache.Client()
+
+
 # Utility functions.
-def _GetXsrfKey():
-  """Returns the current key for generating and verifying XSRF tokens."""
-  client = memcache.Client()
-  xsrf_key = client.get('xsrf_key')
-  if not xsrf_key:
-    config = models.GetApplicationConfiguration()
-    xsrf_key = config.xsrf_key
-    client.set('xsrf_key', xsrf_key)
-  return xsrf_key
+def _GetXsrfKeyring():
+  """Returns the XSRF keyring; see models.Config.XsrfKeyring()."""
+  if time.time() - _xsrf_keyring_cache['loaded_at'] < _XSRF_KEYRING_TTL:
+    return _xsrf_keyring_cache['keyring']
+  with timing.Span('xsrf_keyring'), _xsrf_keyring_lock:
+    # Another thread may have reloaded the keyring while this one waited.
+    now = time.time()
+    if now - _xsrf_keyring_cache['loaded_at'] < _XSRF_KEYRING_TTL:
+      return _xsrf_keyring_cache['keyring']
+    keyring = _memcache_client.get(_XSRF_KEYRING_MEMCACHE_KEY)
+    if not keyring:
+      keyring = models.GetApplicationConfiguration().XsrfKeyring()
+      _memcache_client.set(_XSRF_KEYRING_MEMCACHE_KEY, keyring,
+                           time=_XSRF_KEYRING_MEMCACHE_TTL)
+    _xsrf_keyring_cache['keyring'] = keyring
+    _xsrf_keyring_cache['loaded_at'] = now
+  return keyring
+
+
+def GenerateSignedToken(subject, action='*'):
+  """Returns a token for subject and action, made with the active XSRF key.
+
+  Besides XSRF tokens, this can sign any short-lived value the application
+  hands to clients and later needs to trust, by making it part of action.
+  """
+  keyring = _GetXsrfKeyring()
+  key_id = keyring['active']
+  return xsrf.GenerateToken(keyring['keys'][key_id], subject, action,
+                            key_id=key_id)
+
+
+def ValidateSignedToken(subject, token, action='*',
+                        max_age=xsrf.DEFAULT_TIMEOUT_):
+  """Returns True if GenerateSignedToken made token, at most max_age ago."""
+  return xsrf.ValidateToken(_GetXsrfKeyring()['keys'], subject, token, action,
+                            max_age)
+
+
+# Requests sent with a token from GenerateProfilerToken() in this header are
+# profiled; see profiler.
+PROFILER_TOKEN_HEADER = 'X-Profiler-Token'
+_PROFILER_TOKEN_SUBJECT = 'profiler'
+_PROFILER_TOKEN_ACTION = 'profile requests'
+_PROFILER_TOKEN_MAX_AGE = 60 * 60
+
+
+def GenerateProfilerToken():
+  """Returns a token which has requests sent with it profiled, for an hour."""
+  return GenerateSignedToken(_PROFILER_TOKEN_SUBJECT, _PROFILER_TOKEN_ACTION)
+
+
+def RotateXsrfKeys():
+  """Takes the next step in XSRF key rotation; see models.RotateXsrfKeys().
+
+  Run this regularly from a cron handler.
+  """
+  keyring = models.RotateXsrfKeys()
+  _memcache_client.set(_XSRF_KEYRING_MEMCACHE_KEY, keyring,
+                       time=_XSRF_KEYRING_MEMCACHE_TTL)
 
 
 def _GetCspNonce():
@@ -95,6 +183,142 @@ def _GetCspNonce():
   return base64.b64encode(os.urandom(nonce_length * 2))[:nonce_length]
 
 
+# The app registry key under which each application's _SecurityHeaders live.
+_SECURITY_HEADERS_REGISTRY_KEY = 'base.handlers.security_headers'
+
+
+class _SecurityHeaders(object):
+  """The security headers for an application config, computed once.
+
+  Everything but the CSP nonce is fixed by the app config, so the header
+  values are built when the first request is handled and each response only
+  pays for substituting its nonce into the CSP.
+  """
+
+  def __init__(self, config):
+    headers = []
+    frame_policy = config.get('framing_policy', constants.DENY)
+    frame_header_value = constants.X_FRAME_OPTIONS_VALUES.get(frame_policy, '')
+    if frame_header_value:
+      headers.append(('X-Frame-Options', frame_header_value))
+    headers.append(('X-XSS-Protection', '1; mode=block'))
+    headers.append(('X-Content-Type-Options', 'nosniff'))
+    self._headers = headers
+    self._https_headers = list(headers)
+
+    hsts_policy = config.get('hsts_policy', constants.DEFAULT_HSTS_POLICY)
+    if hsts_policy:
+      include_subdomains = bool(hsts_policy.get('includeSubdomains', False))
+      subdomain_string = '; includeSubdomains' if include_subdomains else ''
+      hsts_value = 'max-age=%d%s' % (int(hsts_policy.get('max_age')),
+                                     subdomain_string)
+      self._https_headers.append(('Strict-Transport-Security', hsts_value))
+
+    csp_policy = config.get('csp_policy', constants.DEFAULT_CSP_POLICY)
+    report_only = False
+    if 'reportOnly' in csp_policy:
+      report_only = csp_policy.get('reportOnly')
+      csp_policy = csp_policy.copy()
+      del csp_policy['reportOnly']
+    self._csp_header_name = ('Content-Security-Policy%s' %
+                             ('-Report-Only' if report_only else ''))
+    directives = []
+    for (k, v) in csp_policy.iteritems():
+      directives.append('%s %s' % (k, v))
+    self._csp_template = '; '.join(directives)
+    self._csp_has_nonce = '%(nonce_value)' in self._csp_template
+    if not self._csp_has_nonce:
+      self._csp_template %= {}
+    # Lowercased, for telling these headers apart from the rest of a response.
+    self.names = frozenset(
+        [name.lower() for (name, _) in self._https_headers] +
+        [self._csp_header_name.lower()])
+
+  def Apply(self, response, scheme, nonce):
+    """Sets the headers on response, with nonce in the CSP.
+
+    Any of these headers response already has are replaced, so that it never
+    carries two policies to be enforced together.
+    """
+    headerlist = response.headerlist
+    headerlist[:] = [header for header in headerlist
+                     if header[0].lower() not in self.names]
+    if scheme.lower() == 'https':
+      headerlist.extend(self._https_headers)
+    else:
+      headerlist.extend(self._headers)
+    csp = self._csp_template
+    if self._csp_has_nonce:
+      # Set random nonce per response
+      csp %= {'nonce_value': nonce}
+    headerlist.append((self._csp_header_name, csp))
+
+
+# The app registry key under which each application's _StaticPages live.
+_STATIC_PAGES_REGISTRY_KEY = 'base.handlers.static_pages'
+
+# CSP nonces and XSRF tokens are made only of characters which no template
+# system escapes, so a _StaticPage can splice them in as they are.  Values with
+# any other character are rendered in full instead.
+_STATIC_PAGE_UNSAFE_VALUE = re.compile(r'[^A-Za-z0-9+/=:]')
+
+
+class _StaticPage(object):
+  """A template's output, split where the CSP nonce and XSRF token go.
+
+  Build() renders the template twice, each time with different stand-ins for
+  the values, and only returns a page if the text around them came out the
+  same: then the template depends on nothing else, and each response only
+  pays for joining the segments with its own values.  The stand-ins differ in
+  length too, so that templates which use a value's length are caught.
+  """
+
+  def __init__(self, segments, slots, compress=False):
+    self._segments = segments
+    # The handler attribute holding the value between each pair of segments.
+    self._slots = slots
+    # A page without values is the same for every response, so its bytes,
+    # and their compressed forms if compress is set, are only made once.
+    self.variants = None
+    if not slots:
+      self.variants = compression.Variants(segments[0].encode('utf-8'),
+                                           compress)
+
+  @classmethod
+  def Build(cls, render, with_xsrf, compress=False):
+    """Returns a _StaticPage, or None if the template can't be split.
+
+    render(xsrf_token, csp_nonce) must return the rendered template.
+    compress is passed on to compression.Variants().
+    """
+    splits = []
+    for length in (8, 12):
+      stand_ins = {'csp_nonce': 'prerender' + os.urandom(length).encode('hex')}
+      if with_xsrf:
+        stand_ins['_xsrf_token'] = ('prerender' +
+                                    os.urandom(length).encode('hex'))
+      text = render(stand_ins.get('_xsrf_token'), stand_ins['csp_nonce'])
+      by_stand_in = dict((v, k) for (k, v) in stand_ins.iteritems())
+      pattern = re.compile('|'.join(by_stand_in))
+      splits.append((pattern.split(text),
+                     [by_stand_in[m] for m in pattern.findall(text)]))
+    if splits[0] != splits[1]:
+      return None
+    (segments, slots) = splits[0]
+    return cls(segments, slots, compress)
+
+  def Render(self, handler):
+    """Returns the page for handler's request, or None if it can't be used."""
+    parts = [self._segments[0]]
+    for (slot, segment) in zip(self._slots, self._segments[1:]):
+      value = getattr(handler, slot)
+      if value is None or _STATIC_PAGE_UNSAFE_VALUE.search(value):
+        return None
+      parts.append(value)
+      parts.append(segment)
+    return ''.join(parts)
+
+
 # Classes with a __metaclass__ of _HandlerMeta may not contain any methods
 # with these names.  This is checked when the class is instantiated.
 _RESTRICTED_FUNCTION_LIST = [
@@ -130,6 +354,11 @@ _RESTRICTED_FUNCTION_CLASS_WHITELIST = [
 _XSSI_PREFIX = ')]}\',\n'
 
 
+# Response headers which are never cached, besides the security headers: they
+# are set again for each response a cached one is written to.
+_UNCACHED_HEADERS = frozenset(['content-length', 'content-encoding', 'etag'])
+
+
 class SecurityError(Exception):
   pass
 
@@ -161,21 +390,16 @@ class BaseHandler(webapp2.RequestHandler):
 
   __metaclass__ = _HandlerMeta
 
+  # A microcache.ResponseCache to answer GET requests from; see microcache.
+  response_cache = None
+
   def __init__(self, request, response):
     self.initialize(request, response)
-    api_fixer.ReplaceDefaultArgument(response.set_cookie.im_func, 'secure',
-                                     not constants.IS_DEV_APPSERVER)
-    api_fixer.ReplaceDefaultArgument(response.set_cookie.im_func, 'httponly',
-                                     True)
-    if self.current_user:
-      self._xsrf_token = xsrf.GenerateToken(_GetXsrfKey(),
-                                            self.current_user.email())
-      if self.app.config.get('using_angular', constants.DEFAULT_ANGULAR):
-        # AngularJS requires a JS readable XSRF-TOKEN cookie and will pass this
-        # back in AJAX requests.
-        self.response.set_cookie('XSRF-TOKEN', self._xsrf_token, httponly=False)
-    else:
-      self._xsrf_token = None
+    if (self.current_user and
+        self.app.config.get('using_angular', constants.DEFAULT_ANGULAR)):
+      # AngularJS requires a JS readable XSRF-TOKEN cookie and will pass this
+      # back in AJAX requests.
+      self.response.set_cookie('XSRF-TOKEN', self._xsrf_token, httponly=False)
 
     self.csp_nonce = _GetCspNonce()
 
@@ -190,51 +414,123 @@ class BaseHandler(webapp2.RequestHandler):
     raise SecurityError('All response content must originate via render() or'
                         'render_json()')
 
+  def _GetSecurityHeaders(self):
+    """Returns the app's _SecurityHeaders, building them on first use."""
+    security_headers = self.app.registry.get(_SECURITY_HEADERS_REGISTRY_KEY)
+    if security_headers is None:
+      security_headers = _SecurityHeaders(self.app.config)
+      self.app.registry[_SECURITY_HEADERS_REGISTRY_KEY] = security_headers
+    return security_headers
+
   def _SetCommonResponseHeaders(self):
     """Sets various headers with security implications."""
-    frame_policy = self.app.config.get('framing_policy', constants.DENY)
-    frame_header_value = constants.X_FRAME_OPTIONS_VALUES.get(frame_policy, '')
-    if frame_header_value:
-      self.response.headers['X-Frame-Options'] = frame_header_value
-
-    hsts_policy = self.app.config.get('hsts_policy',
-                                      constants.DEFAULT_HSTS_POLICY)
-    if self.request.scheme.lower() == 'https' and hsts_policy:
-      include_subdomains = bool(hsts_policy.get('includeSubdomains', False))
-      subdomain_string = '; includeSubdomains' if include_subdomains else ''
-      hsts_value = 'max-age=%d%s' % (int(hsts_policy.get('max_age')),
-                                     subdomain_string)
-      self.response.headers['Strict-Transport-Security'] = hsts_value
-
-    self.response.headers['X-XSS-Protection'] = '1; mode=block'
-    self.response.headers['X-Content-Type-Options'] = 'nosniff'
-
-    csp_policy = self.app.config.get('csp_policy', constants.DEFAULT_CSP_POLICY)
-    report_only = False
-    if 'reportOnly' in csp_policy:
-      report_only = csp_policy.get('reportOnly')
-      csp_policy = csp_policy.copy()
-      del csp_policy['reportOnly']
-    header_name = ('Content-Security-Policy%s' %
-                   ('-Report-Only' if report_only else ''))
-    directives = []
-    for (k, v) in csp_policy.iteritems():
-      directives.append('%s %s' % (k, v))
-    csp = '; '.join(directives)
-
-    # Set random nonce per response
-    csp = csp % {'nonce_value': self.csp_nonce}
-
-    self.response.headers.add(header_name, csp)
+    self._GetSecurityHeaders().Apply(self.response, self.request.scheme,
+                                     self.csp_nonce)
 
   @webapp2.cached_property
   def current_user(self):
-    return users.get_current_user()
+    with timing.Span('user', self.request):
+      return users.get_current_user()
 
-  def dispatch(self):
-    self._SetCommonResponseHeaders()
-    super(BaseHandler, self).dispatch()
+  @webapp2.cached_property
+  def _xsrf_token(self):
+    """The XSRF token for the current user, or None; made on first use."""
+    if not self.current_user:
+      return None
+    return GenerateSignedToken(self.current_user.email())
+
+  def _RateLimited(self):
+    """Returns True, having answered with a 429, if over the route's limit."""
+    rate_limit = getattr(self.request.route, 'rate_limit', None)
+    if rate_limit is None:
+      return False
+    retry_after = rate_limit.Acquire(self.request)
+    if not retry_after:
+      return False
+    self.response.set_status(429, 'Too Many Requests')
+    self.response.headers['Retry-After'] = str(int(math.ceil(retry_after)))
+    return True
+
+  def _ResponseCacheKey(self):
+    """Returns the response_cache key for this request, or None."""
+    if (self.response_cache is None or self.request.method != 'GET' or
+        self.current_user):
+      return None
+    return self.response_cache.Key(self.request)
+
+  def _WriteCachedResponse(self, cached):
+    """Writes a microcache.CachedResponse, with this response's nonce."""
+    headerlist = self.response.headerlist
+    headerlist[:] = [header for header in headerlist
+                     if header[0].lower() not in cached.header_names]
+    headerlist.extend(cached.headers)
+    if cached.variants:
+      self.write_variants(cached.variants, cached.etag)
+    else:
+      self._WriteBody(cached.Body(self.csp_nonce))
+
+  def _CacheResponse(self, key):
+    """Adds the response to response_cache under key, if it can be reused."""
+    response = self.response
+    if response.status_int != 200 or 'Set-Cookie' in response.headers:
+      return
+    body = response.body
+    encoding = response.headers.get('Content-Encoding')
+    etag = response.headers.get('ETag')
+    if encoding:
+      if encoding not in compression.ENCODINGS:
+        return
+      body = compression.Decompress(body, encoding)
+      # write_variants() gives each encoding its own ETag.
+      if etag and etag.endswith('-%s"' % encoding):
+        etag = etag[:-len(encoding) - 2] + '"'
+    excluded = self._GetSecurityHeaders().names | _UNCACHED_HEADERS
+    headers = [(name, value) for (name, value) in response.headerlist
+               if name.lower() not in excluded]
+    self.response_cache.Put(key, microcache.CachedResponse(
+        headers, body.split(self.csp_nonce), etag and etag.strip('"'),
+        self._CompressResponses()))
+
+  def _Dispatch(self):
+    if self._RateLimited():
+      return
+    cache_key = self._ResponseCacheKey()
+    if cache_key is not None:
+      cached = self.response_cache.Get(cache_key)
+      if cached is not None:
+        self._WriteCachedResponse(cached)
+        return
+    with timing.Span('handler', self.request):
+      super(BaseHandler, self).dispatch()
+    if cache_key is not None:
+      self._CacheResponse(cache_key)
+
+  def _StartProfiler(self):
+    """Returns a running profiler.Sampler if this request is to be profiled."""
+    rate = self.app.config.get('profile_sample_rate', 0)
+    token = self.request.headers.get(PROFILER_TOKEN_HEADER)
+    if not ((rate and random.random() < rate) or
+            (token and ValidateSignedToken(_PROFILER_TOKEN_SUBJECT, token,
+                                           _PROFILER_TOKEN_ACTION,
+                                           _PROFILER_TOKEN_MAX_AGE))):
+      return None
+    sampler = profiler.Sampler()
+    sampler.Start()
+    return sampler
 
+  def dispatch(self):
+    sampler = self._StartProfiler()
+    try:
+      with timing.Span('headers', self.request):
+        self._SetCommonResponseHeaders()
+      self._Dispatch()
+    finally:
+      if sampler is not None:
+        sampler.Stop()
+    if self.app.config.get('server_timing', constants.DEBUG):
+      server_timing = timing.ServerTiming(self.request)
+      if server_timing:
+        self.response.headers['Server-Timing'] = server_timing
 
   @classmethod
   def get_jinja2_config(cls):
@@ -263,7 +559,13 @@ class BaseHandler(webapp2.RequestHandler):
       Args:
         app: the WSGIApplication
     """
-    return jinja2.Jinja2(app, BaseHandler.get_jinja2_config())
+    import template_cache  # Imports jinja2 itself, so only load it here.
+    config = BaseHandler.get_jinja2_config()
+    bytecode_cache = template_cache.MakeBytecodeCache(
+        app.config.get('jinja2_bytecode_cache', constants.NO_BYTECODE_CACHE))
+    if bytecode_cache:
+      config['environment_args']['bytecode_cache'] = bytecode_cache
+    return _ImportJinja2().Jinja2(app, config)
 
   @webapp2.cached_property
   def jinja2(self):
@@ -271,31 +573,119 @@ class BaseHandler(webapp2.RequestHandler):
       Get the cached Jinja2 instance from the app registry, if none exists
       the factory function is used to create one.
     """
-    return jinja2.get_jinja2(self.j2_factory, app=self.app)
+    return _ImportJinja2().get_jinja2(self.j2_factory, app=self.app)
 
   def render_to_string(self, template, template_values=None):
     """Renders template_name with template_values and returns as a string."""
+    with timing.Span('render', self.request):
+      return self._RenderToString(template, template_values, self._xsrf_token,
+                                  self.csp_nonce)
+
+  def _RenderToString(self, template, template_values, xsrf_token, csp_nonce):
     if not template_values:
       template_values = {}
 
-    template_values['_xsrf'] = self._xsrf_token
-    template_values['_csp_nonce'] = self.csp_nonce
+    template_values['_xsrf'] = xsrf_token
+    template_values['_csp_nonce'] = csp_nonce
     template_strategy = self.app.config.get('template', constants.CLOSURE)
 
     if template_strategy == constants.DJANGO:
+      django = _ImportDjango()
       t = django.template.loader.get_template(template)
       template_values = django.template.Context(template_values)
       return t.render(template_values)
     elif template_strategy == constants.JINJA2:
       return self.jinja2.render_template(template, **template_values)
     else:
-      ijdata = { 'csp_nonce': self.csp_nonce }
+      ijdata = { 'csp_nonce': csp_nonce }
       return template(template_values, ijdata)
 
+  def warm_up(self, templates=()):
+    """Primes per-instance state which requests otherwise set up lazily.
+
+    Loads the XSRF keys and compiles the given templates with the configured
+    template system, so that a warmup request can pay for them up front.
+    """
+    _GetXsrfKeyring()
+    template_strategy = self.app.config.get('template', constants.CLOSURE)
+    for template in templates:
+      if template_strategy == constants.DJANGO:
+        _ImportDjango().template.loader.get_template(template)
+      elif template_strategy == constants.JINJA2:
+        self.jinja2.environment.get_template(template)
+
   def render(self, template, template_values=None):
     """Renders template with template_values and writes to the response."""
     template_strategy = self.app.config.get('template', constants.CLOSURE)
-    self._RawWrite(self.render_to_string(template, template_values))
+    self._WriteBody(self.render_to_string(template, template_values))
+
+  def _CompressResponses(self):
+    """Returns True if responses are compressed here; see compression."""
+    return self.app.config.get('compress_responses',
+                               constants.DEFAULT_COMPRESS_RESPONSES)
+
+  def _WriteBody(self, body):
+    """Writes body, compressed if compress_responses is on and it pays off."""
+    if isinstance(body, unicode):
+      body = body.encode(self.response.charset or 'utf-8')
+    if not self._CompressResponses():
+      self._RawWrite(body)
+      return
+    compression.AddVary(self.response, 'Accept-Encoding')
+    encoding = compression.Negotiate(self.request)
+    if encoding and len(body) >= compression.MIN_SIZE:
+      body = compression.Compress(body, encoding)
+      self.response.headers['Content-Encoding'] = encoding
+    self._RawWrite(body)
+
+  def write_variants(self, variants, etag=None):
+    """Writes a body from compression.Variants(), encoded as the client allows.
+
+    If etag is given, the ETag header is set to it, with a suffix for each
+    encoding, and a request whose If-None-Match has that ETag gets an empty
+    304 instead.
+    """
+    encoding = compression.IDENTITY
+    if self._CompressResponses():
+      compression.AddVary(self.response, 'Accept-Encoding')
+      encoding = compression.Negotiate(self.request)
+      if encoding not in variants:
+        encoding = compression.IDENTITY
+    if etag is not None:
+      if encoding != compression.IDENTITY:
+        etag = '%s-%s' % (etag, encoding)
+      self.response.headers['ETag'] = '"%s"' % etag
+      if etag in self.request.if_none_match:
+        self.response.set_status(304)
+        return
+    if encoding != compression.IDENTITY:
+      self.response.headers['Content-Encoding'] = encoding
+    self._RawWrite(variants[encoding])
+
+  def render_static(self, template):
+    """Renders a template which uses no values but _csp_nonce and _xsrf.
+
+    The output is the same as render(template), but the template is only
+    rendered once per application; after that, responses only splice in
+    their own CSP nonce and XSRF token.  Templates that turn out to depend on
+    anything else are rendered in full every time.
+    """
+    pages = self.app.registry.setdefault(_STATIC_PAGES_REGISTRY_KEY, {})
+    key = (template, self.current_user is not None, self._CompressResponses())
+    if key not in pages:
+      pages[key] = _StaticPage.Build(
+          lambda xsrf_token, csp_nonce: self._RenderToString(
+              template, {}, xsrf_token, csp_nonce),
+          with_xsrf=key[1], compress=key[2])
+    page = pages[key]
+    if page and page.variants:
+      self.write_variants(page.variants)
+      return
+    body = page.Render(self) if page else None
+    if body is None:
+      self.render(template)
+    else:
+      self._WriteBody(body)
 
 
 class BaseCronHandler(BaseHandler):
@@ -389,8 +779,7 @@ class AuthenticatedHandler(BaseHandler):
         token[0] == '"' and token[-1] == '"'):
       token = token[1:-1]
 
-    if xsrf.ValidateToken(_GetXsrfKey(), self.current_user.email(),
-                          token):
+    if ValidateSignedToken(self.current_user.email(), token):
       return True
     return False
 
@@ -433,8 +822,7 @@ class AuthenticatedAjaxHandler(BaseAjaxHandler):
         token[0] == '"' and token[-1] == '"'):
       token = token[1:-1]
 
-    if xsrf.ValidateToken(_GetXsrfKey(), self.current_user.email(),
-                          token):
+    if ValidateSignedToken(self.current_user.email(), token):
       return True
     return False
 
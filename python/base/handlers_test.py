@@ -13,13 +13,24 @@
 #     limitations under the License.
 """Tests for base.handlers."""
 
+import datetime
 import exceptions
+import os
+import threading
+import time
 import unittest2
 import webapp2
+import webob
 
+import constants
 import handlers
+import microcache
+import models
+import profiler
 import xsrf
 
+from google.appengine.api import memcache
+from google.appengine.api import users
 from google.appengine.ext import testbed
 
 
@@ -63,6 +74,18 @@ class DummyTaskHandler(handlers.BaseTaskHandler):
     self._RawWrite('get_succeeded')
 
 
+class _FakeSampler(object):
+  """Stands in for profiler.Sampler, counting the requests it would profile."""
+
+  started = 0
+
+  def Start(self):
+    _FakeSampler.started += 1
+
+  def Stop(self):
+    pass
+
+
 class HandlersTest(unittest2.TestCase):
   """Test cases for base.handlers."""
 
@@ -71,6 +94,7 @@ class HandlersTest(unittest2.TestCase):
     self.testbed.activate()
     self.testbed.init_datastore_v3_stub()
     self.testbed.init_memcache_stub()
+    handlers._xsrf_keyring_cache['loaded_at'] = 0
     self.app = webapp2.WSGIApplication([('/', DummyHandler),
                                         ('/ajax', DummyAjaxHandler),
                                         ('/cron', DummyCronHandler),
@@ -113,13 +137,53 @@ class HandlersTest(unittest2.TestCase):
   def testXsrfProtectionSucceedsWithValidToken(self):
     self._FakeLogin()
 
-    key = handlers._GetXsrfKey()
-    token = xsrf.GenerateToken(key, 'user@example.com')
+    keyring = handlers._GetXsrfKeyring()
+    token = xsrf.GenerateToken(keyring['keys'][keyring['active']],
+                               'user@example.com', key_id=keyring['active'])
     self.assertEqual('post_succeeded',
                      self.app.get_response('/',
                                            method='POST',
                                            POST={'xsrf': token}).body)
 
+  def testXsrfTokenIsMadeOnFirstUse(self):
+    self._FakeLogin()
+    request = webapp2.Request.blank('/')
+    request.app = self.app
+    self.app.set_globals(app=self.app, request=request)
+    handler = DummyHandler(request, webapp2.Response())
+    self.assertNotIn('_xsrf_token', handler.__dict__)
+    self.assertNotIn('Set-Cookie', handler.response.headers)
+    token = handler._xsrf_token
+    self.assertTrue(xsrf.ValidateToken(
+        handlers._GetXsrfKeyring()['keys'], 'user@example.com', token))
+
+    self.app.config['using_angular'] = True
+    handler = DummyHandler(request, webapp2.Response())
+    cookie = handler.response.headers['Set-Cookie']
+    self.assertTrue(cookie.startswith('XSRF-TOKEN='))
+    self.assertIn(handler._xsrf_token, cookie)
+
+  def testXsrfTokensSurviveKeyRotation(self):
+    self._FakeLogin()
+    tokens = [xsrf.GenerateToken(models.GetApplicationConfiguration().xsrf_key,
+                                 'user@example.com')]
+    now = datetime.datetime.utcnow() + datetime.timedelta(seconds=1)
+    for step in (models._XSRF_KEY_ROTATION_PERIOD,
+                 models._XSRF_KEY_PROPAGATION_DELAY) * 2:
+      now += step
+      models.RotateXsrfKeys(now)
+      handlers._xsrf_keyring_cache['loaded_at'] = 0
+      memcache.flush_all()
+      tokens.append(handlers.GenerateSignedToken(
+          users.get_current_user().email()))
+      # Tokens made just before each step are still accepted after it.
+      for token in tokens[-2:]:
+        self.assertEqual('post_succeeded',
+                         self.app.get_response('/', method='POST',
+                                               POST={'xsrf': token}).body)
+    self.assertEqual(['0', '1', '1', '2'],
+                     [token.split(':')[0] for token in tokens[1:]])
+
   def testResponseHasStrictCSP(self):
     """Checks that the CSP in the response is set and strict.
     More information: https://www.w3.org/TR/CSP3/#strict-dynamic-usage
@@ -128,6 +192,7 @@ class HandlersTest(unittest2.TestCase):
     strictScriptSrc = ['\'strict-dynamic\'', '\'nonce-%s\'' % fakeNonce]
     strictObjectSrc = ['\'none\'']
 
+    self.addCleanup(setattr, handlers, '_GetCspNonce', handlers._GetCspNonce)
     handlers._GetCspNonce = lambda : fakeNonce
 
     headers = self.app.get_response('/', method='GET').headers
@@ -139,6 +204,78 @@ class HandlersTest(unittest2.TestCase):
     self.assertTrue(set(strictScriptSrc) <= set(csp.get('script-src')))
     self.assertListEqual(strictObjectSrc, csp.get('object-src'))
 
+  def testSecurityHeaders(self):
+    headers = self.app.get_response('/').headers
+    self.assertEqual('DENY', headers.get('X-Frame-Options'))
+    self.assertEqual('nosniff', headers.get('X-Content-Type-Options'))
+    self.assertEqual('1; mode=block', headers.get('X-XSS-Protection'))
+    self.assertIsNone(headers.get('Strict-Transport-Security'))
+
+    headers = self.app.get_response('https://localhost/').headers
+    self.assertEqual('max-age=2592000; includeSubdomains',
+                     headers.get('Strict-Transport-Security'))
+
+  def testCspNonceChangesPerResponse(self):
+    nonces = iter(['first', 'second'])
+    get_csp_nonce = handlers._GetCspNonce
+    handlers._GetCspNonce = lambda: next(nonces)
+    try:
+      first = self.app.get_response('/').headers['Content-Security-Policy']
+      second = self.app.get_response('/').headers['Content-Security-Policy']
+    finally:
+      handlers._GetCspNonce = get_csp_nonce
+    self.assertIn('\'nonce-first\'', first)
+    self.assertEqual(first.replace('first', 'second'), second)
+
+  def testSecurityHeadersFollowAppConfig(self):
+    app = webapp2.WSGIApplication([('/', DummyAjaxHandler)], config={
+        'framing_policy': constants.SAMEORIGIN,
+        'hsts_policy': None,
+        'csp_policy': {'default-src': '\'self\'', 'reportOnly': True},
+    })
+    headers = app.get_response('https://localhost/').headers
+    self.assertEqual('SAMEORIGIN', headers.get('X-Frame-Options'))
+    self.assertIsNone(headers.get('Strict-Transport-Security'))
+    self.assertIsNone(headers.get('Content-Security-Policy'))
+    self.assertEqual('default-src \'self\'',
+                     headers.get('Content-Security-Policy-Report-Only'))
+
+  def testSecurityHeadersReplaceEarlierOnes(self):
+    response = webapp2.Response()
+    response.headers['Content-Security-Policy'] = "default-src *"
+    response.headers['x-frame-options'] = 'SAMEORIGIN'
+    security_headers = handlers._SecurityHeaders(
+        {'csp_policy': {'default-src': "'self'"}})
+    for _ in range(2):
+      security_headers.Apply(response, 'https', 'n0nce')
+    self.assertEqual(["default-src 'self'"],
+                     response.headers.getall('Content-Security-Policy'))
+    self.assertEqual(['DENY'], response.headers.getall('X-Frame-Options'))
+    self.assertEqual(1, len(response.headers.getall(
+        'Strict-Transport-Security')))
+
+  def testServerTimingFollowsAppConfig(self):
+    self.app.config['server_timing'] = True
+    self.assertIn('headers;dur=',
+                  self.app.get_response('/ajax').headers['Server-Timing'])
+    self.app.config['server_timing'] = False
+    self.assertNotIn('Server-Timing', self.app.get_response('/ajax').headers)
+
+  def testRequestsAreProfiledWhenSampledOrSigned(self):
+    self.addCleanup(setattr, profiler, 'Sampler', profiler.Sampler)
+    profiler.Sampler = _FakeSampler
+    _FakeSampler.started = 0
+
+    for headers in ({}, {handlers.PROFILER_TOKEN_HEADER: 'bogus'}):
+      self.app.get_response('/ajax', headers=headers)
+    self.assertEqual(0, _FakeSampler.started)
+
+    self.app.get_response('/ajax', headers={
+        handlers.PROFILER_TOKEN_HEADER: handlers.GenerateProfilerToken()})
+    self.app.config['profile_sample_rate'] = 1
+    self.app.get_response('/ajax')
+    self.assertEqual(2, _FakeSampler.started)
+
   def testAjaxGetResponsesIncludeXssiPrefix(self):
     self.assertEqual(handlers._XSSI_PREFIX, self.app.get_response('/ajax').body)
 
@@ -175,5 +312,165 @@ class HandlersTest(unittest2.TestCase):
                      self.app.get_response('/task',
                                            headers=headers).body)
 
+class XsrfKeyringCacheTest(unittest2.TestCase):
+  """Test cases for the per-instance copy of the XSRF keyring."""
+
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_datastore_v3_stub()
+    self.testbed.init_memcache_stub()
+    handlers._xsrf_keyring_cache['loaded_at'] = 0
+    self.get_configuration = models.GetApplicationConfiguration
+
+  def tearDown(self):
+    models.GetApplicationConfiguration = self.get_configuration
+    handlers._xsrf_keyring_cache['loaded_at'] = 0
+    self.testbed.deactivate()
+
+  def testKeyringIsReusedUntilItExpires(self):
+    keyring = handlers._GetXsrfKeyring()
+    self.assertEqual(keyring, memcache.get('xsrf_keyring'))
+    config = models.GetApplicationConfiguration()
+    config.xsrf_keys[0].changed -= models._XSRF_KEY_ROTATION_PERIOD
+    config.put()
+    handlers.RotateXsrfKeys()
+    self.assertEqual(keyring, handlers._GetXsrfKeyring())
+    handlers._xsrf_keyring_cache['loaded_at'] -= handlers._XSRF_KEYRING_TTL
+    self.assertEqual(2, len(handlers._GetXsrfKeyring()['keys']))
+
+  def testPropagationOutlastsCaches(self):
+    self.assertGreater(
+        models._XSRF_KEY_PROPAGATION_DELAY.total_seconds(),
+        handlers._XSRF_KEYRING_TTL + handlers._XSRF_KEYRING_MEMCACHE_TTL)
+
+  def testConcurrentMissesReadTheDatastoreOnce(self):
+    calls = []
+
+    def SlowGetApplicationConfiguration():
+      calls.append(1)
+      time.sleep(0.05)
+      return self.get_configuration()
+
+    models.GetApplicationConfiguration = SlowGetApplicationConfiguration
+    keyrings = []
+    threads = [threading.Thread(target=lambda: keyrings.append(
+        handlers._GetXsrfKeyring())) for _ in range(10)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEqual(1, len(calls))
+    self.assertEqual(10, len(keyrings))
+    self.assertTrue(all(k is keyrings[0] for k in keyrings))
+
+
+class DummyCachedHandler(handlers.BaseHandler):
+  """Counts its calls, and writes a body using the CSP nonce."""
+
+  response_cache = microcache.ResponseCache(
+      ttl=60, headers=['X-AppEngine-Country'],
+      variant=lambda request: None if 'nocache' in request.GET else '')
+  calls = 0
+
+  def get(self):
+    DummyCachedHandler.calls += 1
+    if 'cookie' in self.request.GET:
+      self.response.set_cookie('c', 'v')
+    self.response.headers['Content-Type'] = 'text/plain'
+    self._RawWrite('<script nonce="%s">%s</script>' %
+                   (self.csp_nonce, self.request.headers.get(
+                       'X-AppEngine-Country')))
+
+
+class ResponseCacheTest(unittest2.TestCase):
+  """Test cases for BaseHandler.response_cache."""
+
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_user_stub()
+    # Signed out, whatever earlier tests left in the environment.
+    self.testbed.setup_env(USER_EMAIL='', USER_ID='', overwrite=True)
+    DummyCachedHandler.response_cache.Clear()
+    DummyCachedHandler.calls = 0
+    self.app = webapp2.WSGIApplication([('/', DummyCachedHandler)])
+
+  def tearDown(self):
+    self.testbed.deactivate()
+
+  def _Get(self, path='/', country='US'):
+    # webapp2's get_response() adds its own default headers to the response.
+    return webob.Request.blank(
+        path, headers=[('X-AppEngine-Country', country)]).get_response(self.app)
+
+  def _Nonce(self, response):
+    for (name, value) in response.headerlist:
+      if name.startswith('Content-Security-Policy'):
+        return value.split('\'nonce-', 1)[1].split('\'', 1)[0]
+
+  def testHitsSkipTheHandlerAndGetTheirOwnNonce(self):
+    first = self._Get()
+    second = self._Get()
+    self.assertEqual(1, DummyCachedHandler.calls)
+    self.assertNotEqual(self._Nonce(first), self._Nonce(second))
+    for response in (first, second):
+      self.assertEqual('<script nonce="%s">US</script>' % self._Nonce(response),
+                       response.body)
+      self.assertEqual('text/plain', response.content_type)
+      self.assertEqual('nosniff', response.headers['X-Content-Type-Options'])
+    self.assertEqual(1, len(second.headers.getall('Content-Type')))
+
+  def testResponsesAreKeyedOnHeadersAndVariant(self):
+    self._Get()
+    self.assertIn('FR', self._Get(country='FR').body)
+    self._Get('/?nocache')
+    self._Get('/?nocache')
+    self.assertEqual(4, DummyCachedHandler.calls)
+
+  def testResponsesWithCookiesOrUsersAreNotCached(self):
+    self._Get('/?cookie')
+    self._Get('/?cookie')
+    self.testbed.setup_env(USER_EMAIL='user@example.com', USER_ID='123',
+                           overwrite=True)
+    self._Get()
+    self._Get()
+    self.assertEqual(4, DummyCachedHandler.calls)
+
+
+class _Values(object):
+  """Stands in for a handler in _StaticPage.Render()."""
+
+  def __init__(self, csp_nonce, xsrf_token=None):
+    self.csp_nonce = csp_nonce
+    self._xsrf_token = xsrf_token
+
+
+class StaticPageTest(unittest2.TestCase):
+  """Test cases for base.handlers._StaticPage."""
+
+  def _Template(self, xsrf_token, csp_nonce):
+    return ('<script nonce="%s"></script><form>%s</form><p nonce="%s">' %
+            (csp_nonce, xsrf_token, csp_nonce))
+
+  def testSplicedPagesMatchRenderedOnes(self):
+    for xsrf_token in (None, '1:1500000000:abcdef'):
+      page = handlers._StaticPage.Build(self._Template,
+                                        with_xsrf=xsrf_token is not None)
+      nonce = 'aB3+/x=='
+      self.assertEqual(self._Template(xsrf_token, nonce),
+                       page.Render(_Values(nonce, xsrf_token)))
+
+  def testTemplatesDependingOnMoreCannotBeSplit(self):
+    for render in (lambda xsrf_token, nonce: os.urandom(4).encode('hex'),
+                   lambda xsrf_token, nonce: str(len(nonce)),
+                   lambda xsrf_token, nonce: nonce.upper()):
+      self.assertIsNone(handlers._StaticPage.Build(render, with_xsrf=False))
+
+  def testValuesNeedingEscapingAreNotSpliced(self):
+    page = handlers._StaticPage.Build(self._Template, with_xsrf=False)
+    self.assertIsNone(page.Render(_Values('"><script>')))
+
+
 if __name__ == '__main__':
   unittest2.main()
@@ -0,0 +1,113 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+"""Short-lived, per-instance caches of whole GET responses.
+
+A handler opts in by declaring a ResponseCache:
+
+  class RootHandler(handlers.BaseHandler):
+    response_cache = microcache.ResponseCache(
+        ttl=60, headers=['X-AppEngine-Country'])
+
+BaseHandler.dispatch() then answers a GET from the cache, without calling the
+handler method, when a response for the same path and query, values of the
+given request headers and variant is less than ttl seconds old.  Only
+requests without a signed in user are cached, and only 200 responses which
+set no cookies.
+
+The security headers are not cached but set for each response as usual.  A
+cached body is split where the CSP nonce of the response it came from was, so
+that each response gets its own nonce; a body without one is compressed once,
+if the handler compresses responses.
+"""
+
+import collections
+import threading
+import time
+
+import compression
+
+# Past this many responses, a cache evicts the least recently used.
+_DEFAULT_MAX_ENTRIES = 100
+
+
+class CachedResponse(object):
+  """A response's headers and body, with the body split at its CSP nonce."""
+
+  def __init__(self, headers, segments, etag=None, compress=False):
+    # (name, value) pairs, set in place of any the response already has.
+    self.headers = headers
+    self.header_names = frozenset(name.lower() for (name, _) in headers)
+    self._segments = segments
+    # The body only has a validator and compressed forms if it is the same
+    # for every response.
+    self.etag = None
+    self.variants = None
+    if len(segments) == 1:
+      self.etag = etag
+      self.variants = compression.Variants(segments[0], compress)
+
+  def Body(self, nonce):
+    """Returns the body, with nonce wherever the original's nonce was."""
+    return nonce.join(self._segments)
+
+
+class ResponseCache(object):
+  """Caches responses for ttl seconds, keeping up to max_entries of them.
+
+  Responses are told apart by path and query string, by the values of the
+  request headers named in headers, and by variant(request) if variant is
+  given.  A variant of None means the request is not to be cached.
+  """
+
+  def __init__(self, ttl, headers=(), variant=None,
+               max_entries=_DEFAULT_MAX_ENTRIES):
+    self.ttl = ttl
+    self.headers = tuple(headers)
+    self.variant = variant
+    self.max_entries = max_entries
+    self._lock = threading.Lock()
+    # key -> (expiry time, CachedResponse), least recently used first.
+    self._entries = collections.OrderedDict()
+
+  def Key(self, request):
+    """Returns the cache key for request, or None if it is not cacheable."""
+    variant = self.variant(request) if self.variant else ''
+    if variant is None:
+      return None
+    return (request.path_qs,
+            tuple(request.headers.get(name) for name in self.headers),
+            variant)
+
+  def Get(self, key, now=None):
+    """Returns the CachedResponse for key, or None if there is none."""
+    now = time.time() if now is None else now
+    with self._lock:
+      entry = self._entries.pop(key, None)
+      if entry is None or entry[0] <= now:
+        return None
+      self._entries[key] = entry
+      return entry[1]
+
+  def Put(self, key, response, now=None):
+    """Caches a CachedResponse under key."""
+    now = time.time() if now is None else now
+    with self._lock:
+      self._entries.pop(key, None)
+      self._entries[key] = (now + self.ttl, response)
+      while len(self._entries) > self.max_entries:
+        self._entries.popitem(last=False)
+
+  def Clear(self):
+    with self._lock:
+      self._entries.clear()
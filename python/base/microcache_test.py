@@ -0,0 +1,78 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+"""Tests for base.microcache."""
+
+import unittest2
+import webapp2
+
+import compression
+import microcache
+
+
+def _Request(path='/', country='US'):
+  request = webapp2.Request.blank(path)
+  request.headers['X-AppEngine-Country'] = country
+  return request
+
+
+class ResponseCacheTest(unittest2.TestCase):
+  """Test cases for base.microcache.ResponseCache."""
+
+  def testKey(self):
+    cache = microcache.ResponseCache(ttl=10, headers=['X-AppEngine-Country'])
+    self.assertEqual(cache.Key(_Request()), cache.Key(_Request()))
+    for request in (_Request('/?a=1'), _Request('/other'),
+                    _Request(country='FR')):
+      self.assertNotEqual(cache.Key(_Request()), cache.Key(request))
+
+    cache = microcache.ResponseCache(
+        ttl=10, variant=lambda request: request.GET.get('v'))
+    self.assertIsNone(cache.Key(_Request()))
+    self.assertIsNotNone(cache.Key(_Request('/?v=1')))
+
+  def testEntriesExpire(self):
+    cache = microcache.ResponseCache(ttl=10)
+    response = microcache.CachedResponse([], ['body'])
+    cache.Put('key', response, now=1000)
+    self.assertIs(response, cache.Get('key', now=1009))
+    self.assertIsNone(cache.Get('key', now=1010))
+    self.assertIsNone(cache.Get('other', now=1000))
+
+  def testLeastRecentlyUsedAreEvicted(self):
+    cache = microcache.ResponseCache(ttl=10, max_entries=2)
+    for key in ('a', 'b'):
+      cache.Put(key, microcache.CachedResponse([], [key]), now=1000)
+    cache.Get('a', now=1000)
+    cache.Put('c', microcache.CachedResponse([], ['c']), now=1000)
+    self.assertIsNone(cache.Get('b', now=1000))
+    self.assertIsNotNone(cache.Get('a', now=1000))
+    self.assertIsNotNone(cache.Get('c', now=1000))
+
+  def testBodiesWithoutNonceAreCompressedOnce(self):
+    body = 'forest ' * compression.MIN_SIZE
+    response = microcache.CachedResponse([], [body], etag='abc')
+    self.assertEqual('abc', response.etag)
+    self.assertEqual({compression.IDENTITY: body}, response.variants)
+    response = microcache.CachedResponse([], [body], 'abc', compress=True)
+    self.assertEqual(body, response.variants[compression.IDENTITY])
+    self.assertIn(compression.GZIP, response.variants)
+
+    response = microcache.CachedResponse([], ['<p nonce="', '">'], etag='abc')
+    self.assertIsNone(response.etag)
+    self.assertIsNone(response.variants)
+    self.assertEqual('<p nonce="n2">', response.Body('n2'))
+
+
+if __name__ == '__main__':
+  unittest2.main()
@@ -15,7 +15,27 @@
 
 from google.appengine.ext import ndb
 
+import datetime
 import os
+import xsrf
+
+# XSRF key states.  New tokens are made with the active key.  Tokens made with
+# pending and retired keys are accepted too, so that no token fails while
+# instances pick up a rotation.
+(XSRF_KEY_PENDING, XSRF_KEY_ACTIVE, XSRF_KEY_RETIRED) = range(0, 3)
+
+# How often the XSRF key is replaced.
+_XSRF_KEY_ROTATION_PERIOD = datetime.timedelta(days=7)
+
+# How long a key stays pending before it is used for new tokens.  This must
+# be longer than instances can go on using an old copy of the keyring: see
+# _XSRF_KEYRING_TTL and _XSRF_KEYRING_MEMCACHE_TTL in base/handlers.py.
+_XSRF_KEY_PROPAGATION_DELAY = datetime.timedelta(minutes=15)
+
+# How long a retired key is kept: until the last tokens made with it expire.
+_XSRF_KEY_RETIRED_LIFETIME = (datetime.timedelta(seconds=xsrf.DEFAULT_TIMEOUT_)
+                              + _XSRF_KEY_PROPAGATION_DELAY)
+
 
 @ndb.transactional
 def GetApplicationConfiguration():
@@ -25,11 +45,75 @@ def GetApplicationConfiguration():
   if not entity:
     entity = Config(key=key)
     entity.xsrf_key = os.urandom(16)
+  if not entity.xsrf_keys:
+    # The key from before keyrings becomes the first one.
+    entity.xsrf_keys = [XsrfKey(key_id=xsrf.LEGACY_KEY_ID_,
+                                secret=entity.xsrf_key,
+                                state=XSRF_KEY_ACTIVE,
+                                changed=datetime.datetime.utcnow())]
     entity.put()
   return entity
 
 
+@ndb.transactional
+def RotateXsrfKeys(now=None):
+  """Takes the next step in replacing the active XSRF key, if one is due.
+
+  Meant to be run regularly, e.g. hourly from cron.  A new key is first added
+  as pending; after _XSRF_KEY_PROPAGATION_DELAY it becomes the active key and
+  the previous one is retired, and later deleted.
+
+  Returns the keyring as Config.XsrfKeyring() does.
+  """
+  now = now or datetime.datetime.utcnow()
+  config = GetApplicationConfiguration()
+  keys = [k for k in config.xsrf_keys
+          if not (k.state == XSRF_KEY_RETIRED and
+                  now - k.changed > _XSRF_KEY_RETIRED_LIFETIME)]
+  pending = [k for k in keys if k.state == XSRF_KEY_PENDING]
+  active = [k for k in keys if k.state == XSRF_KEY_ACTIVE]
+
+  if pending:
+    if now - pending[0].changed >= _XSRF_KEY_PROPAGATION_DELAY:
+      for key in active:
+        key.state = XSRF_KEY_RETIRED
+        key.changed = now
+      pending[0].state = XSRF_KEY_ACTIVE
+      pending[0].changed = now
+  elif not active or now - active[0].changed >= _XSRF_KEY_ROTATION_PERIOD:
+    keys.append(XsrfKey(key_id=max(k.key_id for k in keys) + 1,
+                        secret=os.urandom(16),
+                        state=XSRF_KEY_PENDING,
+                        changed=now))
+
+  config.xsrf_keys = keys
+  config.put()
+  return config.XsrfKeyring()
+
+
+class XsrfKey(ndb.Model):
+  """One of the keys XSRF tokens are made with."""
+
+  key_id = ndb.IntegerProperty()
+  secret = ndb.BlobProperty()
+  state = ndb.IntegerProperty()
+  # When the key entered its current state.
+  changed = ndb.DateTimeProperty()
+
+
 class Config(ndb.Model):
   """A simple key-value store for application configuration settings."""
 
+  # The only XSRF key before keyrings; xsrf_keys holds it with key id 0.
   xsrf_key = ndb.BlobProperty()
+  xsrf_keys = ndb.LocalStructuredProperty(XsrfKey, repeated=True)
+
+  def XsrfKeyring(self):
+    """Returns the XSRF keys as a dict made only of builtins.
+
+    'active' is the id of the key to make new tokens with, and 'keys' maps the
+    ids of all keys tokens are accepted from to the keys themselves.
+    """
+    active = [k.key_id for k in self.xsrf_keys if k.state == XSRF_KEY_ACTIVE]
+    return {'active': active[0],
+            'keys': dict((k.key_id, k.secret) for k in self.xsrf_keys)}
@@ -13,6 +13,7 @@
 #     limitations under the License.
 """Tests for base.models."""
 
+import datetime
 import unittest2
 
 import models
@@ -27,11 +28,47 @@ class ModelsTest(unittest2.TestCase):
     self.testbed = testbed.Testbed()
     self.testbed.activate()
     self.testbed.init_datastore_v3_stub()
+    self.testbed.init_memcache_stub()
+
+  def tearDown(self):
+    self.testbed.deactivate()
 
   def testConfigurationAutomaticallyGenerated(self):
     config = models.GetApplicationConfiguration()
     self.assertIsNotNone(config)
     self.assertIsNotNone(config.xsrf_key)
+    self.assertEqual({'active': 0, 'keys': {0: config.xsrf_key}},
+                     config.XsrfKeyring())
+
+  def testLegacyConfigurationIsMigrated(self):
+    models.Config(id='config', xsrf_key='legacy').put()
+    config = models.GetApplicationConfiguration()
+    self.assertEqual({'active': 0, 'keys': {0: 'legacy'}},
+                     config.XsrfKeyring())
+
+  def testXsrfKeyRotation(self):
+    keyring = models.RotateXsrfKeys()
+    self.assertEqual([0], keyring['keys'].keys())
+    now = datetime.datetime.utcnow()
+
+    now += models._XSRF_KEY_ROTATION_PERIOD
+    keyring = models.RotateXsrfKeys(now)
+    self.assertEqual(0, keyring['active'])
+    self.assertEqual([0, 1], sorted(keyring['keys']))
+
+    # Promoted only once every instance may have seen the pending key.
+    keyring = models.RotateXsrfKeys(
+        now + models._XSRF_KEY_PROPAGATION_DELAY / 2)
+    self.assertEqual(0, keyring['active'])
+    now += models._XSRF_KEY_PROPAGATION_DELAY
+    keyring = models.RotateXsrfKeys(now)
+    self.assertEqual(1, keyring['active'])
+    self.assertEqual([0, 1], sorted(keyring['keys']))
+
+    now += models._XSRF_KEY_RETIRED_LIFETIME + datetime.timedelta(seconds=1)
+    keyring = models.RotateXsrfKeys(now)
+    self.assertEqual(1, keyring['active'])
+    self.assertEqual([1], sorted(keyring['keys']))
 
 
 if __name__ == '__main__':
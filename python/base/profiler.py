@@ -0,0 +1,122 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+"""A sampling profiler for individual requests.
+
+While a Sampler runs, a second thread reads the stack of the thread handling
+the request every _INTERVAL seconds, through sys._current_frames().  The
+stacks seen are counted per instance and read back by Collapsed() in the
+collapsed format of flame graph tools: one line per stack, outermost frame
+first, with frames separated by semicolons and followed by the count.
+
+Nothing here runs for requests which are not profiled; BaseHandler decides
+which are, from the 'profile_sample_rate' app config setting or a signed
+profiler token header.
+"""
+
+import os
+import sys
+import threading
+import time
+
+# Seconds between samples.
+_INTERVAL = 0.005
+
+# Stacks are cut to their innermost _MAX_DEPTH frames.
+_MAX_DEPTH = 64
+
+# Past this many distinct stacks, samples of new ones are counted together.
+_MAX_STACKS = 5000
+_OTHER_STACKS = '(other)'
+
+_lock = threading.Lock()
+
+# collapsed stack -> number of samples.
+_stacks = {}
+
+# code object -> frame label.
+_labels = {}
+
+
+def _Label(code):
+  label = _labels.get(code)
+  if label is None:
+    # The file's directory tells apart modules such as handlers and
+    # base/handlers.
+    (directory, name) = os.path.split(code.co_filename)
+    label = _labels[code] = '%s/%s:%s' % (os.path.basename(directory), name,
+                                          code.co_name)
+  return label
+
+
+def _Collapse(frame):
+  labels = []
+  while frame is not None and len(labels) < _MAX_DEPTH:
+    labels.append(_Label(frame.f_code))
+    frame = frame.f_back
+  labels.reverse()
+  return ';'.join(labels)
+
+
+def _Add(counts):
+  """Adds a {collapsed stack: samples} dict to the instance's counts."""
+  with _lock:
+    for (stack, count) in counts.iteritems():
+      if stack not in _stacks and len(_stacks) >= _MAX_STACKS:
+        stack = _OTHER_STACKS
+      _stacks[stack] = _stacks.get(stack, 0) + count
+
+
+class Sampler(object):
+  """Samples the stack of the thread which started it, until it is stopped."""
+
+  def __init__(self, interval=_INTERVAL):
+    self._interval = interval
+    self._thread_id = None
+    self._thread = None
+    self._stopped = False
+    self._counts = {}
+
+  def Start(self):
+    self._thread_id = threading.current_thread().ident
+    self._thread = threading.Thread(target=self._Run)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def Stop(self):
+    """Stops sampling and adds the samples taken to the instance's counts."""
+    self._stopped = True
+    self._thread.join()
+    _Add(self._counts)
+
+  def _Run(self):
+    while not self._stopped:
+      time.sleep(self._interval)
+      frame = sys._current_frames().get(self._thread_id)
+      if frame is None:
+        return
+      stack = _Collapse(frame)
+      self._counts[stack] = self._counts.get(stack, 0) + 1
+
+
+def Collapsed():
+  """Returns the stacks sampled on this instance, in collapsed format."""
+  with _lock:
+    stacks = sorted(_stacks.iteritems(), key=lambda item: (-item[1], item[0]))
+  return ''.join('%s %d\n' % item for item in stacks)
+
+
+def Samples():
+  """Returns the number of samples taken on this instance."""
+  with _lock:
+    return sum(_stacks.itervalues())
@@ -0,0 +1,59 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+"""Tests for base.profiler."""
+
+import time
+import unittest2
+
+import profiler
+
+
+def _Busy(seconds):
+  end = time.time() + seconds
+  while time.time() < end:
+    pass
+
+
+class ProfilerTest(unittest2.TestCase):
+  """Test cases for base.profiler."""
+
+  def setUp(self):
+    profiler._stacks.clear()
+
+  def tearDown(self):
+    profiler._stacks.clear()
+
+  def testSamplesAreCollapsed(self):
+    sampler = profiler.Sampler(interval=0.001)
+    sampler.Start()
+    _Busy(0.05)
+    sampler.Stop()
+
+    self.assertGreater(profiler.Samples(), 0)
+    lines = profiler.Collapsed().splitlines()
+    (stack, count) = lines[0].rsplit(' ', 1)
+    self.assertGreater(int(count), 0)
+    frames = stack.split(';')
+    self.assertIn('base/profiler_test.py:testSamplesAreCollapsed', frames)
+    self.assertTrue(any(f.endswith('profiler_test.py:_Busy') for f in frames))
+
+  def testNewStacksPastTheLimitAreCountedTogether(self):
+    self.addCleanup(setattr, profiler, '_MAX_STACKS', profiler._MAX_STACKS)
+    profiler._MAX_STACKS = 1
+    for stack in ('a;b', 'a;c', 'a;d', 'a;b'):
+      profiler._Add({stack: 1})
+    self.assertEqual('(other) 2\na;b 2\n', profiler.Collapsed())
+
+if __name__ == '__main__':
+  unittest2.main()
@@ -0,0 +1,149 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+"""Per-client request rate limits for individual routes.
+
+A route opts in by being a RateLimitedRoute in the main.py route tables:
+
+  rate_limit.RateLimitedRoute('/csp', handlers.CspHandler,
+                              rate_limit=rate_limit.RateLimit(1, burst=20))
+
+BaseHandler.dispatch() then answers requests over the limit with a 429 and a
+Retry-After header, without calling the handler method.
+
+Every instance keeps a token bucket per client, so most checks need no RPC.
+Every _SYNC_INTERVAL seconds a client's bucket adds what it let through to a
+shared counter in memcache, for the current _WINDOW second window.  Once the
+counter shows a client has gone over its allowance across all instances, each
+instance turns it away until the window ends.
+"""
+
+import logging
+import math
+import threading
+import time
+
+import webapp2
+
+import constants
+
+from google.appengine.api import memcache
+
+_NAMESPACE = 'rate_limit'
+
+# Length of the shared counting windows, in seconds.
+_WINDOW = 60
+
+# How often an instance adds a client's local count to the shared one.
+_SYNC_INTERVAL = 5
+
+# Past this many clients, an instance forgets the buckets it has.
+_MAX_BUCKETS = 10000
+
+
+class _Bucket(object):
+
+  def __init__(self, tokens, now):
+    self.tokens = tokens
+    self.updated_at = now
+    self.blocked_until = 0
+    # Requests allowed since the last sync, and when that was.
+    self.unsynced = 0
+    self.synced_at = now
+
+
+class RateLimit(object):
+  """Allows each client rate requests per second, in bursts of up to burst.
+
+  Clients are told apart by key: constants.RATE_LIMIT_BY_IP (the default) or
+  constants.RATE_LIMIT_BY_COUNTRY.
+  """
+
+  def __init__(self, rate, burst=None, key=constants.RATE_LIMIT_BY_IP,
+               name=None):
+    self.rate = float(rate)
+    self.burst = burst if burst is not None else max(int(math.ceil(rate)), 1)
+    self.key = key
+    # Shared counters are named after the route unless a name is given.
+    self.name = name
+    self._lock = threading.Lock()
+    self._buckets = {}
+
+  def _ClientKey(self, request):
+    if self.key == constants.RATE_LIMIT_BY_COUNTRY:
+      return request.headers.get('X-AppEngine-Country') or 'ZZ'
+    return request.remote_addr or ''
+
+  def Acquire(self, request, now=None):
+    """Takes a token for the client making request.
+
+    Returns 0 if the request may go ahead, or else the number of seconds the
+    client should wait before trying again.
+    """
+    now = time.time() if now is None else now
+    client = self._ClientKey(request)
+    with self._lock:
+      bucket = self._buckets.get(client)
+      if bucket is None:
+        if len(self._buckets) >= _MAX_BUCKETS:
+          self._buckets.clear()
+        bucket = self._buckets[client] = _Bucket(self.burst, now)
+
+      if now < bucket.blocked_until:
+        return bucket.blocked_until - now
+      bucket.tokens = min(self.burst,
+                          bucket.tokens + (now - bucket.updated_at) * self.rate)
+      bucket.updated_at = now
+      if bucket.tokens < 1:
+        return (1 - bucket.tokens) / self.rate
+      bucket.tokens -= 1
+      bucket.unsynced += 1
+
+      if now - bucket.synced_at < _SYNC_INTERVAL:
+        return 0
+      unsynced = bucket.unsynced
+      bucket.unsynced = 0
+      bucket.synced_at = now
+
+    # The request that triggers a sync is let through either way.
+    self._Sync(client, bucket, unsynced, now)
+    return 0
+
+  def _Sync(self, client, bucket, unsynced, now):
+    """Adds a client's local count to the shared one for this window."""
+    window = int(now // _WINDOW)
+    key = '%s:%s:%d' % (self.name, client, window)
+    try:
+      total = memcache.incr(key, delta=unsynced, namespace=_NAMESPACE,
+                            initial_value=0)
+    except Exception:
+      # Whatever goes wrong with memcache must not fail the request.
+      logging.warning('Could not sync rate limit counts', exc_info=True)
+      total = None
+    if total is None:
+      # Memcache is unavailable; the local limit still applies.
+      return
+    if total > self.rate * _WINDOW + self.burst:
+      with self._lock:
+        bucket.blocked_until = (window + 1) * _WINDOW
+        bucket.tokens = 0
+
+
+class RateLimitedRoute(webapp2.Route):
+  """A webapp2.Route whose requests are limited by a RateLimit."""
+
+  def __init__(self, template, handler=None, rate_limit=None, **kwargs):
+    super(RateLimitedRoute, self).__init__(template, handler, **kwargs)
+    self.rate_limit = rate_limit
+    if rate_limit is not None and rate_limit.name is None:
+      rate_limit.name = template
@@ -0,0 +1,152 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+"""Tests for base.rate_limit."""
+
+import unittest2
+import webapp2
+
+import constants
+import handlers
+import rate_limit
+
+from google.appengine.ext import testbed
+
+
+class DummyAjaxHandler(handlers.BaseAjaxHandler):
+
+  def post(self):
+    self.render_json({})
+
+
+def _Request(remote_addr='10.0.0.1', country='US'):
+  request = webapp2.Request.blank('/', remote_addr=remote_addr)
+  request.headers['X-AppEngine-Country'] = country
+  return request
+
+
+class RateLimitTest(unittest2.TestCase):
+  """Test cases for base.rate_limit.RateLimit."""
+
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_memcache_stub()
+
+  def tearDown(self):
+    self.testbed.deactivate()
+
+  def testBurstThenRate(self):
+    limit = rate_limit.RateLimit(2, burst=3, name='test')
+    for _ in range(3):
+      self.assertEqual(0, limit.Acquire(_Request(), now=1000))
+    self.assertAlmostEqual(0.5, limit.Acquire(_Request(), now=1000))
+    self.assertEqual(0, limit.Acquire(_Request(), now=1000.5))
+    self.assertGreater(limit.Acquire(_Request(), now=1000.5), 0)
+    # Other clients have their own buckets.
+    self.assertEqual(0, limit.Acquire(_Request('10.0.0.2'), now=1000.5))
+
+  def testCountryKey(self):
+    limit = rate_limit.RateLimit(1, burst=1, name='test',
+                                 key=constants.RATE_LIMIT_BY_COUNTRY)
+    self.assertEqual(0, limit.Acquire(_Request('10.0.0.1', 'FR'), now=1000))
+    self.assertGreater(limit.Acquire(_Request('10.0.0.2', 'FR'), now=1000), 0)
+    self.assertEqual(0, limit.Acquire(_Request('10.0.0.1', 'DE'), now=1000))
+
+  def testInstancesShareCountsThroughMemcache(self):
+    # Two instances, each allowing a client 1 request a second.
+    instances = [rate_limit.RateLimit(1, burst=1, name='test')
+                 for _ in range(2)]
+    allowance = rate_limit._WINDOW + 1
+    now = 1200.0
+    allowed = 0
+    while now < 1200 + rate_limit._WINDOW:
+      for instance in instances:
+        if not instance.Acquire(_Request(), now=now):
+          allowed += 1
+      now += 1
+    # Each instance alone would have let through rate * _WINDOW requests.
+    self.assertLess(allowed, 2 * rate_limit._WINDOW)
+    self.assertLessEqual(allowed, allowance + 2 * rate_limit._SYNC_INTERVAL)
+    retry_after = instances[0].Acquire(_Request(), now=now - 1)
+    self.assertGreater(retry_after, 0)
+    self.assertLessEqual(retry_after, rate_limit._WINDOW)
+    # The next window starts afresh.
+    self.assertEqual(0, instances[0].Acquire(_Request(), now=now + 1))
+
+  def _BreakMemcache(self, incr):
+    self.addCleanup(setattr, rate_limit.memcache, 'incr',
+                    rate_limit.memcache.incr)
+    rate_limit.memcache.incr = incr
+
+  def _AssertLocalLimitApplies(self):
+    limit = rate_limit.RateLimit(1, burst=1, name='test')
+    self.assertEqual(0, limit.Acquire(_Request(), now=1000))
+    self.assertGreater(limit.Acquire(_Request(), now=1000), 0)
+    self.assertEqual(0, limit.Acquire(_Request(), now=1000 +
+                                      rate_limit._SYNC_INTERVAL))
+    self.assertGreater(limit.Acquire(_Request(), now=1000 +
+                                     rate_limit._SYNC_INTERVAL), 0)
+
+  def testMemcacheOutageFallsBackToLocalLimit(self):
+    self._BreakMemcache(lambda *args, **kwargs: None)
+    self._AssertLocalLimitApplies()
+
+  def testMemcacheErrorsFallBackToLocalLimit(self):
+    def Incr(*args, **kwargs):
+      raise AssertionError('No api proxy found for service "memcache"')
+    self._BreakMemcache(Incr)
+    self._AssertLocalLimitApplies()
+
+
+class RateLimitedRouteTest(unittest2.TestCase):
+  """Test cases for rate limited routes in BaseHandler.dispatch()."""
+
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_memcache_stub()
+    self.testbed.init_user_stub()
+    self.limit = rate_limit.RateLimit(1, burst=2)
+    self.app = webapp2.WSGIApplication([
+        rate_limit.RateLimitedRoute('/limited', DummyAjaxHandler,
+                                    rate_limit=self.limit),
+        ('/unlimited', DummyAjaxHandler)])
+
+  def tearDown(self):
+    self.testbed.deactivate()
+
+  def testRoutesAreNamedAfterTheirTemplate(self):
+    self.assertEqual('/limited', self.limit.name)
+
+  def testRequestsOverTheLimitGet429(self):
+    for _ in range(2):
+      response = self.app.get_response('/limited', method='POST',
+                                       remote_addr='10.0.0.1')
+      self.assertEqual(200, response.status_int)
+    response = self.app.get_response('/limited', method='POST',
+                                     remote_addr='10.0.0.1')
+    self.assertEqual(429, response.status_int)
+    self.assertEqual('1', response.headers['Retry-After'])
+    self.assertEqual('', response.body)
+    self.assertIn('X-Content-Type-Options', response.headers)
+
+  def testUnlimitedRoutesAreUnaffected(self):
+    for _ in range(5):
+      response = self.app.get_response('/unlimited', method='POST',
+                                       remote_addr='10.0.0.1')
+      self.assertEqual(200, response.status_int)
+
+
+if __name__ == '__main__':
+  unittest2.main()
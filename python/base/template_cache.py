@@ -0,0 +1,107 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+"""Jinja2 bytecode caches that outlive a single App Engine instance.
+
+Without a bytecode cache every new instance parses and compiles each template
+on its first render.  Two shared caches are available through the
+'jinja2_bytecode_cache' app config setting:
+
+  MEMCACHE_BYTECODE_CACHE: the first instance to compile a template stores its
+    bytecode in memcache, and later instances load it from there.
+
+  PRECOMPILED_BYTECODE_CACHE: templates are compiled before deploying by
+    running this module, and instances load the bytecode from the application
+    files.  Templates missing from the cache are compiled as usual.
+
+Jinja2 checks the template source checksum of any cached bytecode, so a stale
+entry is recompiled rather than served.
+"""
+
+import hashlib
+import os
+import sys
+
+import jinja2
+
+import constants
+
+from google.appengine.api import memcache
+
+
+class MemcacheBytecodeCache(jinja2.MemcachedBytecodeCache):
+  """Shares template bytecode between instances through memcache."""
+
+  def __init__(self):
+    super(MemcacheBytecodeCache, self).__init__(memcache.Client(),
+                                                prefix='jinja2/bytecode/')
+
+
+class PrecompiledBytecodeCache(jinja2.FileSystemBytecodeCache):
+  """Loads template bytecode compiled at deploy time.
+
+  Bucket keys depend on the template name only, since absolute paths differ
+  between the machine compiling the templates and the serving instances.
+  Writes are skipped unless writable is set, as the App Engine file system is
+  read-only.
+  """
+
+  def __init__(self, directory=constants.PRECOMPILED_TEMPLATE_DIR,
+               writable=False):
+    super(PrecompiledBytecodeCache, self).__init__(directory)
+    self.writable = writable
+
+  def get_cache_key(self, name, filename=None):
+    return hashlib.sha1(name.encode('utf-8')).hexdigest()
+
+  def load_bytecode(self, bucket):
+    try:
+      super(PrecompiledBytecodeCache, self).load_bytecode(bucket)
+    except (IOError, OSError):
+      pass
+
+  def dump_bytecode(self, bucket):
+    if self.writable:
+      super(PrecompiledBytecodeCache, self).dump_bytecode(bucket)
+
+
+def MakeBytecodeCache(setting):
+  """Returns the bytecode cache for a 'jinja2_bytecode_cache' setting."""
+  if setting == constants.MEMCACHE_BYTECODE_CACHE:
+    return MemcacheBytecodeCache()
+  elif setting == constants.PRECOMPILED_BYTECODE_CACHE:
+    return PrecompiledBytecodeCache()
+  return None
+
+
+def Precompile(names, directory=constants.PRECOMPILED_TEMPLATE_DIR):
+  """Compiles the named templates into directory for PrecompiledBytecodeCache.
+
+  The environment is configured like the one BaseHandler renders with, as the
+  generated code depends on settings such as autoescaping.
+  """
+  import handlers
+  if not os.path.isdir(directory):
+    os.makedirs(directory)
+  config = handlers.BaseHandler.get_jinja2_config()
+  environment = jinja2.Environment(
+      loader=jinja2.FileSystemLoader(config['template_path']),
+      bytecode_cache=PrecompiledBytecodeCache(directory, writable=True),
+      **config['environment_args'])
+  for name in names:
+    environment.get_template(name)
+
+
+if __name__ == '__main__':
+  # Run before deploying, e.g.: python template_cache.py index.html
+  Precompile(sys.argv[1:])
@@ -0,0 +1,88 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+"""Tests for base.template_cache."""
+
+import os
+import shutil
+import tempfile
+import unittest2
+
+import jinja2
+
+import constants
+import template_cache
+
+from google.appengine.ext import testbed
+
+_TEMPLATE = 'config.template'
+
+
+class TemplateCacheTest(unittest2.TestCase):
+  """Test cases for base.template_cache."""
+
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_memcache_stub()
+    self.directory = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+    self.testbed.deactivate()
+
+  def _Environment(self, bytecode_cache):
+    return jinja2.Environment(
+        loader=jinja2.FileSystemLoader(constants.TEMPLATE_DIR),
+        bytecode_cache=bytecode_cache)
+
+  def testMakeBytecodeCache(self):
+    self.assertIsNone(
+        template_cache.MakeBytecodeCache(constants.NO_BYTECODE_CACHE))
+    self.assertIsInstance(
+        template_cache.MakeBytecodeCache(constants.MEMCACHE_BYTECODE_CACHE),
+        template_cache.MemcacheBytecodeCache)
+    self.assertIsInstance(
+        template_cache.MakeBytecodeCache(constants.PRECOMPILED_BYTECODE_CACHE),
+        template_cache.PrecompiledBytecodeCache)
+
+  def testMemcacheCacheIsSharedBetweenEnvironments(self):
+    cache = template_cache.MemcacheBytecodeCache()
+    self._Environment(cache).get_template(_TEMPLATE)
+    bucket = cache.get_bucket(self._Environment(None), _TEMPLATE,
+                              os.path.join(constants.TEMPLATE_DIR, _TEMPLATE),
+                              open(os.path.join(constants.TEMPLATE_DIR,
+                                                _TEMPLATE)).read())
+    self.assertIsNotNone(bucket.code)
+
+  def testPrecompiledCacheIsReadOnlyWhenServing(self):
+    self._Environment(
+        template_cache.PrecompiledBytecodeCache(self.directory)).get_template(
+            _TEMPLATE)
+    self.assertEqual([], os.listdir(self.directory))
+
+  def testPrecompileWritesOneFilePerTemplate(self):
+    template_cache.Precompile(['index.html', _TEMPLATE], self.directory)
+    self.assertEqual(2, len(os.listdir(self.directory)))
+    cache = template_cache.PrecompiledBytecodeCache(self.directory)
+    template = self._Environment(cache).get_template(_TEMPLATE)
+    self.assertIn('CONFIG', template.render(default_region='us', servers=[]))
+
+  def testMissingCacheDirectoryIsIgnored(self):
+    cache = template_cache.PrecompiledBytecodeCache(
+        os.path.join(self.directory, 'missing'))
+    self._Environment(cache).get_template(_TEMPLATE)
+
+
+if __name__ == '__main__':
+  unittest2.main()
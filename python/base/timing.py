@@ -0,0 +1,140 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+"""Timings of the phases of handling a request.
+
+Code marks a phase with a span:
+
+  with timing.Span('render'):
+    ...
+
+Every span's duration is added to an in-memory histogram for its name, per
+instance, which Histograms() reads back as percentiles.  The spans of the
+request being handled are also kept in its registry, for ServerTiming().
+Code which has the request at hand should pass it to Span: finding it
+through webapp2.get_request() costs more than the rest of a span.
+"""
+
+import math
+import threading
+import time
+
+import webapp2
+
+# Relative width of a histogram bucket; percentiles are accurate to about 10%.
+_GAMMA = 1.1
+_MIN_MS = 0.01
+_MAX_MS = 60 * 1000
+_NUM_BUCKETS = int(math.ceil(math.log(_MAX_MS / _MIN_MS, _GAMMA))) + 1
+
+# The percentiles reported by Histograms().
+PERCENTILES = (50, 90, 99)
+
+# The request registry key under which a request's spans are listed.
+_REQUEST_SPANS_KEY = 'base.timing.spans'
+
+_lock = threading.Lock()
+
+# span name -> _Histogram of its durations.
+_histograms = {}
+
+
+class _Histogram(object):
+  """Counts durations in milliseconds in logarithmically sized buckets."""
+
+  def __init__(self):
+    self.buckets = [0] * _NUM_BUCKETS
+    self.count = 0
+    self.max = 0.0
+
+  def Add(self, ms):
+    index = int(math.ceil(math.log(min(max(ms, _MIN_MS), _MAX_MS) / _MIN_MS,
+                                   _GAMMA)))
+    self.buckets[index] += 1
+    self.count += 1
+    self.max = max(self.max, ms)
+
+  def Percentile(self, p):
+    """Returns the upper bound of the bucket holding the p-th percentile."""
+    rank = p / 100.0 * self.count
+    seen = 0
+    for (i, n) in enumerate(self.buckets):
+      seen += n
+      if n and seen >= rank:
+        return min(_MIN_MS * _GAMMA ** i, self.max)
+    return None
+
+
+class Span(object):
+  """Times the block of a with statement under name, for request.
+
+  request defaults to the one being handled, if any.
+  """
+
+  __slots__ = ('name', 'request', '_start')
+
+  def __init__(self, name, request=None):
+    self.name = name
+    self.request = request
+
+  def __enter__(self):
+    self._start = time.time()
+    return self
+
+  def __exit__(self, *unused_exc_info):
+    Record(self.name, (time.time() - self._start) * 1000, self.request)
+
+
+def _CurrentRequest():
+  try:
+    return webapp2.get_request()
+  except AssertionError:
+    # Not handling a request, as in a deferred call or the shell.
+    return None
+
+
+def Record(name, ms, request=None):
+  """Records a span of ms milliseconds, for request or the current one too."""
+  with _lock:
+    histogram = _histograms.get(name)
+    if histogram is None:
+      histogram = _histograms[name] = _Histogram()
+    histogram.Add(ms)
+  if request is None:
+    request = _CurrentRequest()
+  if request is not None:
+    request.registry.setdefault(_REQUEST_SPANS_KEY, []).append((name, ms))
+
+
+def ServerTiming(request):
+  """Returns a Server-Timing header value for request's spans, or None."""
+  spans = request.registry.get(_REQUEST_SPANS_KEY)
+  if not spans:
+    return None
+  return ', '.join('%s;dur=%.2f' % span for span in spans)
+
+
+def Histograms():
+  """Returns {span name: summary} for the spans this instance has seen.
+
+  Each summary is a dict with the count and the maximum and PERCENTILES of
+  the durations, as 'p50' and so on, in milliseconds.
+  """
+  with _lock:
+    summaries = {}
+    for (name, histogram) in _histograms.iteritems():
+      summary = {'count': histogram.count, 'max': histogram.max}
+      for p in PERCENTILES:
+        summary['p%d' % p] = histogram.Percentile(p)
+      summaries[name] = summary
+  return summaries
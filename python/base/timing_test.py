@@ -0,0 +1,64 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+"""Tests for base.timing."""
+
+import unittest2
+import webapp2
+
+import timing
+
+
+class TimingTest(unittest2.TestCase):
+  """Test cases for base.timing."""
+
+  def setUp(self):
+    timing._histograms.clear()
+
+  def tearDown(self):
+    timing._histograms.clear()
+
+  def testPercentiles(self):
+    for ms in range(1, 101):
+      timing.Record('test', ms)
+    summary = timing.Histograms()['test']
+    self.assertEqual(100, summary['count'])
+    self.assertEqual(100, summary['max'])
+    self.assertAlmostEqual(50, summary['p50'], delta=5)
+    self.assertAlmostEqual(90, summary['p90'], delta=9)
+    self.assertAlmostEqual(99, summary['p99'], delta=10)
+    self.assertLessEqual(summary['p99'], summary['max'])
+
+  def testSpansAreListedForTheirRequest(self):
+    app = webapp2.WSGIApplication()
+    request = webapp2.Request.blank('/')
+    app.set_globals(app=app, request=request)
+    try:
+      with timing.Span('render'):
+        pass
+      timing.Record('directory', 1.5)
+    finally:
+      app.clear_globals()
+    server_timing = timing.ServerTiming(request)
+    self.assertRegexpMatches(server_timing,
+                             r'^render;dur=\d+\.\d\d, directory;dur=1\.50$')
+    self.assertIsNone(timing.ServerTiming(webapp2.Request.blank('/')))
+
+  def testSpansOutsideRequestsAreOnlyAggregated(self):
+    with timing.Span('deferred'):
+      pass
+    self.assertEqual(1, timing.Histograms()['deferred']['count'])
+
+
+if __name__ == '__main__':
+  unittest2.main()
@@ -20,8 +20,19 @@ import time
 DELIMITER_ = ':'
 DEFAULT_TIMEOUT_ = 86400
 
+# Tokens without a key id were made before keys had ids, with this one.
+LEGACY_KEY_ID_ = 0
 
-def _Compare(a, b):
+# New tokens are timestamped to a multiple of this many seconds, so that a
+# user's requests within it need the same HMAC, which _Digest then reuses.
+TIMESTAMP_BUCKET_ = 60
+
+# Past this many HMACs, the cache of them is started afresh.
+_MAX_CACHED_DIGESTS = 10000
+_digests = {}
+
+
+def _LoopCompare(a, b):
   """Compares a and b in constant time and returns True if they are equal."""
   if len(a) != len(b):
     return False
@@ -31,26 +42,73 @@ def _Compare(a, b):
 
   return result == 0
 
+# hmac.compare_digest is only in Python 2.7.7 and later.
+_compare_digest = getattr(hmac, 'compare_digest', _LoopCompare)
+
+
+def _Compare(a, b):
+  """Compares a and b in constant time and returns True if they are equal."""
+  # Tokens come back from requests as unicode; digests are always ASCII.
+  if isinstance(a, unicode):
+    a = a.encode('utf-8')
+  if isinstance(b, unicode):
+    b = b.encode('utf-8')
+  return _compare_digest(a, b)
+
+
+def _Digest(key, user, action, timestamp):
+  """Returns the HMAC of a token's fields, computing it only if necessary."""
+  cache_key = (key, user, action, timestamp)
+  digest = _digests.get(cache_key)
+  if digest is None:
+    message = DELIMITER_.join([user, action, str(timestamp)])
+    digest = hmac.new(key, message, hashlib.sha1).hexdigest()
+    if len(_digests) >= _MAX_CACHED_DIGESTS:
+      _digests.clear()
+    _digests[cache_key] = digest
+  return digest
+
 
-def GenerateToken(key, user, action='*', now=None):
-  """Generates an XSRF token for the provided user and action."""
-  token_timestamp = now or int(time.time())
-  message = DELIMITER_.join([user, action, str(token_timestamp)])
-  digest = hmac.new(key, message, hashlib.sha1).hexdigest()
-  return DELIMITER_.join([str(token_timestamp), digest])
+def GenerateToken(key, user, action='*', now=None, key_id=None):
+  """Generates an XSRF token for the provided user and action.
+
+  If key_id is given, it is embedded in the token so that ValidateToken can
+  find key among several.
+  """
+  token_timestamp = int(now or
+                        time.time() // TIMESTAMP_BUCKET_ * TIMESTAMP_BUCKET_)
+  digest = _Digest(key, user, action, token_timestamp)
+  if key_id is None:
+    return DELIMITER_.join([str(token_timestamp), digest])
+  return DELIMITER_.join([str(key_id), str(token_timestamp), digest])
 
 
 def ValidateToken(key, user, token, action='*', max_age=DEFAULT_TIMEOUT_):
-  """Validates the provided XSRF token."""
+  """Validates the provided XSRF token.
+
+  key is either the key the token was made with, or a dict of keys by key id.
+  Tokens without a key id are checked against key LEGACY_KEY_ID_ of a dict.
+  """
   if not token or not user:
     return False
+  parts = token.split(DELIMITER_)
+  if len(parts) == 2:
+    (key_id, timestamp, digest) = [LEGACY_KEY_ID_] + parts
+  elif len(parts) == 3:
+    (key_id, timestamp, digest) = parts
+  else:
+    return False
   try:
-    (timestamp, digest) = token.split(DELIMITER_)
+    key_id = int(key_id)
+    timestamp = int(timestamp)
   except ValueError:
     return False
-  expected = GenerateToken(key, user, action, timestamp)
-  (_, expected_digest) = expected.split(DELIMITER_)
+  if isinstance(key, dict):
+    key = key.get(key_id)
+    if key is None:
+      return False
+  expected_digest = _Digest(key, user, action, timestamp)
   now = int(time.time())
-  if _Compare(expected_digest, digest) and now < int(timestamp) + max_age:
+  if _Compare(expected_digest, digest) and now < timestamp + max_age:
     return True
   return False
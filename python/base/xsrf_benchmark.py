@@ -0,0 +1,97 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+"""Measures the XSRF token work done by logged in requests.
+
+Each simulated request validates the token it carries, as a POST to an
+AuthenticatedHandler does, and makes one for the response.  The legacy rows
+recompute every HMAC and compare digests in a Python loop, as base.xsrf did
+before HMACs were reused and compared with hmac.compare_digest.
+
+Run from this directory with the App Engine SDK on the PYTHONPATH:
+
+  python xsrf_benchmark.py [iterations]
+"""
+
+import hashlib
+import hmac
+import os
+import sys
+import time
+import timeit
+
+try:
+  import dev_appserver
+  dev_appserver.fix_sys_path()
+except ImportError:
+  pass
+
+import xsrf
+
+_DEFAULT_ITERATIONS = 20000
+
+_USER = 'player@example.com'
+
+
+def _LegacyGenerateToken(key, user, action='*', now=None):
+  token_timestamp = now or int(time.time())
+  message = xsrf.DELIMITER_.join([user, action, str(token_timestamp)])
+  digest = hmac.new(key, message, hashlib.sha1).hexdigest()
+  return xsrf.DELIMITER_.join([str(token_timestamp), digest])
+
+
+def _LegacyValidateToken(key, user, token, action='*',
+                         max_age=xsrf.DEFAULT_TIMEOUT_):
+  (timestamp, digest) = token.split(xsrf.DELIMITER_)
+  expected = _LegacyGenerateToken(key, user, action, timestamp)
+  (_, expected_digest) = expected.split(xsrf.DELIMITER_)
+  return (xsrf._LoopCompare(expected_digest, digest) and
+          int(time.time()) < int(timestamp) + max_age)
+
+
+def _Report(name, seconds, iterations):
+  print '%-40s %8.2f us %10.0f req/s' % (name, seconds * 1e6 / iterations,
+                                         iterations / seconds)
+
+
+def main(argv):
+  iterations = int(argv[1]) if len(argv) > 1 else _DEFAULT_ITERATIONS
+  key = os.urandom(16)
+  keys = {1: key}
+  legacy_token = unicode(_LegacyGenerateToken(key, _USER))
+  token = unicode(xsrf.GenerateToken(key, _USER, key_id=1))
+
+  def LegacyRequest():
+    assert _LegacyValidateToken(key, _USER, legacy_token)
+    _LegacyGenerateToken(key, _USER)
+
+  def Request():
+    assert xsrf.ValidateToken(keys, _USER, token)
+    xsrf.GenerateToken(key, _USER, key_id=1)
+
+  def LegacyCompare():
+    xsrf._LoopCompare(legacy_token[-40:], legacy_token[-40:])
+
+  def Compare():
+    xsrf._Compare(token[-40:], token[-40:])
+
+  for (name, run) in (('digest comparison, Python loop', LegacyCompare),
+                      ('digest comparison, compare_digest', Compare),
+                      ('validate + generate, legacy', LegacyRequest),
+                      ('validate + generate, reused HMACs', Request)):
+    seconds = min(timeit.repeat(run, number=iterations, repeat=3))
+    _Report(name, seconds, iterations)
+
+
+if __name__ == '__main__':
+  main(sys.argv)
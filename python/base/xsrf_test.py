@@ -28,9 +28,23 @@ class XsrfTest(unittest2.TestCase):
     self.key = os.urandom(16)
 
   def testCompare(self):
-    self.assertTrue(xsrf._Compare('a', 'a'))
-    self.assertFalse(xsrf._Compare('a', 'b'))
-    self.assertFalse(xsrf._Compare('a', 'ab'))
+    for compare in (xsrf._Compare, xsrf._LoopCompare):
+      self.assertTrue(compare('a', 'a'))
+      self.assertFalse(compare('a', 'b'))
+      self.assertFalse(compare('a', 'ab'))
+    self.assertTrue(xsrf._Compare('abc', u'abc'))
+    self.assertFalse(xsrf._Compare('abc', u'ab\xe9'))
+
+  def testTokensAreReusedWithinABucket(self):
+    now = int(time.time())
+    bucket = now // xsrf.TIMESTAMP_BUCKET_ * xsrf.TIMESTAMP_BUCKET_
+    token = xsrf.GenerateToken(self.key, 'user')
+    self.assertIn(token, (xsrf.GenerateToken(self.key, 'user', now=bucket),
+                          xsrf.GenerateToken(self.key, 'user',
+                                             now=bucket + xsrf.TIMESTAMP_BUCKET_)))
+    self.assertIn((self.key, 'user', '*', int(token.split(':')[0])),
+                  xsrf._digests)
+    self.assertTrue(xsrf.ValidateToken(self.key, 'user', unicode(token)))
 
   def testTokenWithNoActionVerifies(self):
     token = xsrf.GenerateToken(self.key, 'user')
@@ -51,6 +65,25 @@ class XsrfTest(unittest2.TestCase):
     self.assertTrue(xsrf.ValidateToken(self.key, 'user', token, '*',
                                        xsrf.DEFAULT_TIMEOUT_ * 2))
 
+  def testTokensFromAKeyring(self):
+    keys = {1: self.key, 2: os.urandom(16)}
+    token = xsrf.GenerateToken(keys[2], 'user', key_id=2)
+    self.assertTrue(token.startswith('2:'))
+    self.assertTrue(xsrf.ValidateToken(keys, 'user', token))
+    self.assertFalse(xsrf.ValidateToken(keys, 'user', '1' + token[1:]))
+    self.assertFalse(xsrf.ValidateToken(keys, 'user', '3' + token[1:]))
+    self.assertFalse(xsrf.ValidateToken(keys, 'user', 'x' + token[1:]))
+
+  def testLegacyTokensUseTheLegacyKey(self):
+    token = xsrf.GenerateToken(self.key, 'user')
+    keys = {xsrf.LEGACY_KEY_ID_: self.key}
+    self.assertTrue(xsrf.ValidateToken(keys, 'user', token))
+    self.assertFalse(xsrf.ValidateToken({1: self.key}, 'user', token))
+
+  def testMalformedTokensDoNotVerify(self):
+    for token in ('', 'a', 'a:b', '1:2:3:4', 'x:1:abc'):
+      self.assertFalse(xsrf.ValidateToken(self.key, 'user', token))
+
 
 if __name__ == '__main__':
   unittest2.main()
@@ -0,0 +1,115 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Cache of the room server directory and the rendered /config.js payloads.
+
+The directory only changes when a RegionalRoomServer entity is written, and a
+payload only depends on the default region and the hosts assigned to the
+client.  Values are cached in two tiers: a module level dict which lives as
+long as the instance, holding up to _MAX_LOCAL_ENTRIES of the most recently
+used values, and memcache, which is shared by all instances and evicts on its
+own.  Both tiers are keyed on a directory version number
+that is bumped in memcache whenever a RegionalRoomServer entity is written.
+Instances trust their local copy for _LOCAL_TTL seconds before re-checking the
+version, so a hit in the local tier costs no RPCs at all.
+"""
+
+import collections
+import threading
+import time
+
+from google.appengine.api import memcache
+
+_NAMESPACE = 'config_js'
+_VERSION_KEY = 'version'
+
+# How long an instance serves its local copy before re-checking the version.
+_LOCAL_TTL = 30
+
+# Non-ancestor queries are eventually consistent, so a directory read right
+# after a write may miss it; bound how long such a value can live in memcache.
+_MEMCACHE_TTL = 600
+
+# Host assignments multiply the number of distinct payloads by the size of
+# every region's pool, so the local tier only keeps this many values.
+_MAX_LOCAL_ENTRIES = 1000
+
+_lock = threading.Lock()
+
+# key -> (version, time the version was last checked, value), least recently
+# used first.
+_local = collections.OrderedDict()
+
+
+def _get_version():
+  """Returns the current directory version, creating it if necessary."""
+  version = memcache.get(_VERSION_KEY, namespace=_NAMESPACE)
+  if version is None:
+    # Seed from the clock so that an evicted version never goes backwards and
+    # resurrects values cached under an older number.
+    memcache.add(_VERSION_KEY, int(time.time()), namespace=_NAMESPACE)
+    version = memcache.get(_VERSION_KEY, namespace=_NAMESPACE) or 0
+  return version
+
+
+def _get_local(key):
+  with _lock:
+    entry = _local.pop(key, None)
+    if entry is not None:
+      _local[key] = entry
+    return entry
+
+
+def _put_local(key, entry):
+  with _lock:
+    _local.pop(key, None)
+    _local[key] = entry
+    while len(_local) > _MAX_LOCAL_ENTRIES:
+      _local.popitem(last=False)
+
+
+def get(key, render):
+  """Returns the cached value for key, calling render() on a miss.
+
+  Args:
+    key: a string identifying the value.
+    render: a callable taking no arguments which returns the value.  It is
+      only called on a miss in both tiers.  The value must be made of builtin
+      types, since memcache values are unpickled by a restricted unpickler.
+  """
+  now = time.time()
+  entry = _get_local(key)
+  if entry and now - entry[1] < _LOCAL_TTL:
+    return entry[2]
+
+  version = _get_version()
+  if entry and entry[0] == version:
+    _put_local(key, (version, now, entry[2]))
+    return entry[2]
+
+  versioned_key = '%d:%s' % (version, key)
+  value = memcache.get(versioned_key, namespace=_NAMESPACE)
+  if value is None:
+    value = render()
+    memcache.set(versioned_key, value, time=_MEMCACHE_TTL,
+                 namespace=_NAMESPACE)
+  _put_local(key, (version, now, value))
+  return value
+
+
+def invalidate():
+  """Discards every cached value, on this and (eventually) all instances."""
+  memcache.incr(_VERSION_KEY, namespace=_NAMESPACE,
+                initial_value=int(time.time()))
+  with _lock:
+    _local.clear()
@@ -0,0 +1,83 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for config_cache."""
+
+import unittest2
+
+import config_cache
+
+from google.appengine.ext import testbed
+
+
+class ConfigCacheTest(unittest2.TestCase):
+  """Test cases for config_cache."""
+
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_memcache_stub()
+    config_cache._local.clear()
+    self.renders = []
+
+  def tearDown(self):
+    self.testbed.deactivate()
+
+  def _Render(self, body):
+    def render():
+      self.renders.append(body)
+      return body
+    return render
+
+  def testHitSkipsRender(self):
+    self.assertEqual('us', config_cache.get('us', self._Render('us')))
+    self.assertEqual('us', config_cache.get('us', self._Render('other')))
+    self.assertEqual(['us'], self.renders)
+
+  def testRegionsAreCachedSeparately(self):
+    config_cache.get('us', self._Render('us'))
+    self.assertEqual('asia', config_cache.get('asia', self._Render('asia')))
+    self.assertEqual(['us', 'asia'], self.renders)
+
+  def testMemcacheTierIsSharedAcrossInstances(self):
+    config_cache.get('us', self._Render('us'))
+    # Simulate a fresh instance.
+    config_cache._local.clear()
+    self.assertEqual('us', config_cache.get('us', self._Render('other')))
+    self.assertEqual(['us'], self.renders)
+
+  def testLocalTierKeepsTheMostRecentlyUsedValues(self):
+    max_entries = config_cache._MAX_LOCAL_ENTRIES
+    self.addCleanup(setattr, config_cache, '_MAX_LOCAL_ENTRIES', max_entries)
+    config_cache._MAX_LOCAL_ENTRIES = 2
+    config_cache.get('us', self._Render('us'))
+    config_cache.get('asia', self._Render('asia'))
+    config_cache.get('us', self._Render('us'))
+    config_cache.get('europe', self._Render('europe'))
+    self.assertEqual(['us', 'europe'], config_cache._local.keys())
+
+  def testInvalidateForcesRender(self):
+    config_cache.get('us', self._Render('old'))
+    config_cache.invalidate()
+    self.assertEqual('new', config_cache.get('us', self._Render('new')))
+
+  def testOtherInstancesSeeInvalidationAfterLocalTtl(self):
+    config_cache.get('us', self._Render('old'))
+    # Another instance bumps the version without touching our local tier.
+    config_cache.invalidate()
+    config_cache._local['us'] = (-1, 0, 'old')
+    self.assertEqual('new', config_cache.get('us', self._Render('new')))
+
+
+if __name__ == '__main__':
+  unittest2.main()
@@ -12,11 +12,19 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import datetime
+import os
 import sys
+import time
 from random import randint
 from google.appengine.ext import ndb
 import logging
 
+import config_cache
+import hash_ring
+
+from base import timing
+
 # the top level of your domain in which you'll run backend servers, e.g. your-domain.com
 domain = '<insert-your-domain-without-host-part>'
 
@@ -28,304 +36,250 @@ asia = 'asia'
 europe = 'europe'
 
 
-# next we get the list of countries mapped to server they should use,
-# if there's a regional server for that region. country list is
-# derived from http://dev.maxmind.com/static/csv/codes/country_continent.csv
-# & mapped to us/asia/europe thus:
-# NA -> us
-# SA -> us
-# EU -> eu
-# AF -> eu
-# AS -> as
-# OC -> as
-# AN -> us
-
-country_to_server_map = {
-    'A1': us,
-    'A2': us,
-    'AD': europe,
-    'AE': asia,
-    'AF': asia,
-    'AG': us,
-    'AI': us,
-    'AL': europe,
-    'AM': asia,
-    'AN': us,
-    'AO': europe,
-    'AP': asia,
-    'AQ': us,
-    'AR': us,
-    'AS': asia,
-    'AT': europe,
-    'AU': asia,
-    'AW': us,
-    'AX': europe,
-    'AZ': asia,
-    'BA': europe,
-    'BB': us,
-    'BD': asia,
-    'BE': europe,
-    'BF': europe,
-    'BG': europe,
-    'BH': asia,
-    'BI': europe,
-    'BJ': europe,
-    'BL': us,
-    'BM': us,
-    'BN': asia,
-    'BO': us,
-    'BR': us,
-    'BS': us,
-    'BT': asia,
-    'BV': us,
-    'BW': europe,
-    'BY': europe,
-    'BZ': us,
-    'CA': us,
-    'CC': asia,
-    'CD': europe,
-    'CF': europe,
-    'CG': europe,
-    'CH': europe,
-    'CI': europe,
-    'CK': asia,
-    'CL': us,
-    'CM': europe,
-    'CN': asia,
-    'CO': us,
-    'CR': us,
-    'CU': us,
-    'CV': europe,
-    'CX': asia,
-    'CY': asia,
-    'CZ': europe,
-    'DE': europe,
-    'DJ': europe,
-    'DK': europe,
-    'DM': us,
-    'DO': us,
-    'DZ': europe,
-    'EC': us,
-    'EE': europe,
-    'EG': europe,
-    'EH': europe,
-    'ER': europe,
-    'ES': europe,
-    'ET': europe,
-    'EU': europe,
-    'FI': europe,
-    'FJ': asia,
-    'FK': us,
-    'FM': asia,
-    'FO': europe,
-    'FR': europe,
-    'FX': europe,
-    'GA': europe,
-    'GB': europe,
-    'GD': us,
-    'GE': asia,
-    'GF': us,
-    'GG': europe,
-    'GH': europe,
-    'GI': europe,
-    'GL': us,
-    'GM': europe,
-    'GN': europe,
-    'GP': us,
-    'GQ': europe,
-    'GR': europe,
-    'GS': us,
-    'GT': us,
-    'GU': asia,
-    'GW': europe,
-    'GY': us,
-    'HK': asia,
-    'HM': us,
-    'HN': us,
-    'HR': europe,
-    'HT': us,
-    'HU': europe,
-    'ID': asia,
-    'IE': europe,
-    'IL': asia,
-    'IM': europe,
-    'IN': asia,
-    'IO': asia,
-    'IQ': asia,
-    'IR': asia,
-    'IS': europe,
-    'IT': europe,
-    'JE': europe,
-    'JM': us,
-    'JO': asia,
-    'JP': asia,
-    'KE': europe,
-    'KG': asia,
-    'KH': asia,
-    'KI': asia,
-    'KM': europe,
-    'KN': us,
-    'KP': asia,
-    'KR': asia,
-    'KW': asia,
-    'KY': us,
-    'KZ': asia,
-    'LA': asia,
-    'LB': asia,
-    'LC': us,
-    'LI': europe,
-    'LK': asia,
-    'LR': europe,
-    'LS': europe,
-    'LT': europe,
-    'LU': europe,
-    'LV': europe,
-    'LY': europe,
-    'MA': europe,
-    'MC': europe,
-    'MD': europe,
-    'ME': europe,
-    'MF': us,
-    'MG': europe,
-    'MH': asia,
-    'MK': europe,
-    'ML': europe,
-    'MM': asia,
-    'MN': asia,
-    'MO': asia,
-    'MP': asia,
-    'MQ': us,
-    'MR': europe,
-    'MS': us,
-    'MT': europe,
-    'MU': europe,
-    'MV': asia,
-    'MW': europe,
-    'MX': us,
-    'MY': asia,
-    'MZ': europe,
-    'NA': europe,
-    'NC': asia,
-    'NE': europe,
-    'NF': asia,
-    'NG': europe,
-    'NI': us,
-    'NL': europe,
-    'NO': europe,
-    'NP': asia,
-    'NR': asia,
-    'NU': asia,
-    'NZ': asia,
-    'O1': us,
-    'OM': asia,
-    'PA': us,
-    'PE': us,
-    'PF': asia,
-    'PG': asia,
-    'PH': asia,
-    'PK': asia,
-    'PL': europe,
-    'PM': us,
-    'PN': asia,
-    'PR': us,
-    'PS': asia,
-    'PT': europe,
-    'PW': asia,
-    'PY': us,
-    'QA': asia,
-    'RE': europe,
-    'RO': europe,
-    'RS': europe,
-    'RU': europe,
-    'RW': europe,
-    'SA': asia,
-    'SB': asia,
-    'SC': europe,
-    'SD': europe,
-    'SE': europe,
-    'SG': asia,
-    'SH': europe,
-    'SI': europe,
-    'SJ': europe,
-    'SK': europe,
-    'SL': europe,
-    'SM': europe,
-    'SN': europe,
-    'SO': europe,
-    'SR': us,
-    'ST': europe,
-    'SV': us,
-    'SY': asia,
-    'SZ': europe,
-    'TC': us,
-    'TD': europe,
-    'TF': us,
-    'TG': europe,
-    'TH': asia,
-    'TJ': asia,
-    'TK': asia,
-    'TL': asia,
-    'TM': asia,
-    'TN': europe,
-    'TO': asia,
-    'TR': europe,
-    'TT': us,
-    'TV': asia,
-    'TW': asia,
-    'TZ': europe,
-    'UA': europe,
-    'UG': europe,
-    'UM': asia,
-    'US': us,
-    'UY': us,
-    'UZ': asia,
-    'VA': europe,
-    'VC': us,
-    'VE': us,
-    'VG': us,
-    'VI': us,
-    'VN': asia,
-    'VU': asia,
-    'WF': asia,
-    'WS': asia,
-    'YE': asia,
-    'YT': europe,
-    'ZA': europe,
-    'ZM': europe,
-    'ZW': europe,
-    'ZZ': us
+# default region, used for any country we can't place
+default_region = us
+
+# country -> region table, one 'country,region' pair per line. it's read once
+# per instance; see the file itself for how it was derived.
+_country_regions_path = os.path.join(os.path.dirname(__file__),
+                                     'country_regions.csv')
+
+# how long an instance uses its copy of the override table before re-reading
+# it from the datastore, in seconds
+_overrides_ttl = 60
+
+# room servers that heartbeat are dropped from the directory once they've
+# been silent this long, and deleted once they've been gone for a day.
+# servers that have never sent a heartbeat are managed by hand and always listed.
+stale_after = datetime.timedelta(minutes=3)
+delete_after = datetime.timedelta(days=1)
+
+# a server stops taking new players when its occupancy reaches overloaded_at
+# of its capacity, and only comes back once it has drained to available_at.
+# the gap stops a server near the threshold flapping in and out of /config.js.
+overloaded_at = 0.9
+available_at = 0.8
+
+
+def _load_country_regions( path ):
+    table = {}
+    with open( path ) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            country, region = line.split(',')
+            table[country.upper()] = region
+    return table
+
+country_to_server_map = _load_country_regions( _country_regions_path )
+
+_overrides = {
+    'table': {},
+    'loaded_at': 0
 }
 
 
+def _get_overrides():
+    now = time.time()
+    if now - _overrides['loaded_at'] < _overrides_ttl:
+        return _overrides['table']
+
+    try:
+        _overrides['table'] = dict(
+            (override.key.id(), override.region)
+            for override in CountryRegionOverride.query().fetch())
+    except Exception:
+        # keep routing with the table we have rather than failing the request
+        logging.exception("Could not load country region overrides")
+    _overrides['loaded_at'] = now
+    return _overrides['table']
+
+
+# this is on the /config.js request path, so it must never raise: a missing
+# or unknown country just goes to the default region.
 def get_region_for_country( client_country ):
-    region = country_to_server_map[client_country.upper()]
-    if region is None:
-        region = 'us'
+    if not client_country:
+        return default_region
+
+    country = client_country.upper()
+    region = _get_overrides().get(country) or country_to_server_map.get(country)
+    return region or default_region
 
-    return region
 
 def get_all_servers():
-    servers = RegionalRoomServer.query().fetch(10)
+    with timing.Span( 'directory' ):
+        servers = RegionalRoomServer.query().fetch()
+
+    # entities written before heartbeats existed load with available=True.
+    # if everything is full or silent, listing it all beats listing nothing.
+    available = [ server for server in servers if server.available ]
+    return available or servers
+
+
+# seeds an empty directory with a single server for the default region. the
+# entity is keyed by hostname and created transactionally, so concurrent or
+# repeated calls can't write duplicates. this is never called on the read path.
+def bootstrap_directory():
+    if RegionalRoomServer.query().get( keys_only=True ) is not None:
+        return None
+
+    # you'll need to modify this appropriately for your deployment setup
+    hostname = 'forest-rooms-' + default_region + '.' + domain
+    server = RegionalRoomServer.get_or_insert(
+        hostname, name=default_region, hostname=hostname )
+    logging.info("Auto populated datastore")
+    return server
+
+
+# the directory as /config.js needs it, made only of builtins so it can be
+# cached in memcache: a sorted list of hostnames per region, and the least
+# loaded region, for players whose own region has no servers listed.
+def get_directory():
+    servers = get_all_servers()
+    pools = {}
+    occupancy = {}
+    capacity = {}
+    for server in servers:
+        pools.setdefault( server.name, [] ).append( server.hostname )
+        if server.capacity:
+            occupancy[ server.name ] = occupancy.get( server.name, 0 ) + ( server.occupancy or 0 )
+            capacity[ server.name ] = capacity.get( server.name, 0 ) + server.capacity
+    for hostnames in pools.values():
+        hostnames.sort()
+
+    def region_load( region ):
+        if not capacity.get( region ):
+            return 0.0
+        return float( occupancy[ region ] ) / capacity[ region ]
 
-    if servers is None or len(servers) == 0:
-        servers = []
-        server = RegionalRoomServer()
-        server.name = 'us'
-        # you'll need to modify this appropriately for your deployment setup
-        server.hostname = 'forest-rooms-' + server.name + '.' + domain
-        server.put()
+    fallback = min( sorted( pools ), key=region_load ) if pools else default_region
+    return { 'pools': pools, 'fallback': fallback }
 
-        servers.append(server)
-        logging.info("Auto populated datastore")
-    return servers
 
+# the region new players from a country should go to: the requested one if
+# it has servers listed, else the least loaded one.
+def get_available_region( region, directory ):
+    if not directory[ 'pools' ] or region in directory[ 'pools' ]:
+        return region
+
+    return directory[ 'fallback' ]
+
+
+# picks one host per region for a client. each region's hosts form a
+# consistent hash ring, so the same client keeps the same hosts across
+# requests, and adding or removing a host only moves that host's share.
+def assign_hosts( directory, client_id ):
+    return dict(
+        ( region, hash_ring.get_ring( hostnames ).get( client_id ) )
+        for region, hostnames in directory[ 'pools' ].iteritems() )
+
+
+# called (via the task queue) by each room server about once a minute.
+def record_heartbeat( name, hostname, occupancy, capacity ):
+    server = RegionalRoomServer.get_by_id( hostname )
+    if server is None:
+        # adopt a hand-made entity for this host rather than duplicating it
+        server = RegionalRoomServer.query(
+            RegionalRoomServer.hostname == hostname ).get()
+        if server is not None:
+            server._loaded_state = server._directory_state()
+    if server is None:
+        server = RegionalRoomServer( id=hostname, hostname=hostname )
+
+    now = datetime.datetime.utcnow()
+    # a new server, or one back from a silence that may have got it swept
+    # out of the directory, has no earlier state worth keeping
+    fresh = ( server.last_heartbeat is None or
+              now - server.last_heartbeat > stale_after )
+
+    server.name = name
+    server.occupancy = occupancy
+    server.capacity = capacity
+    server.last_heartbeat = now
+
+    load = server.load()
+    if load >= overloaded_at:
+        server.available = False
+    elif load <= available_at or fresh:
+        server.available = True
+    # in between, keep whatever the server was doing
+    server.put()
+    return server
+
+
+# called by cron: take silent servers out of the directory, and forget
+# about ones that have been gone for a long time.
+def sweep_stale_servers():
+    now = datetime.datetime.utcnow()
+    for server in RegionalRoomServer.query().fetch():
+        if server.last_heartbeat is None:
+            continue
+        silence = now - server.last_heartbeat
+        if silence > delete_after:
+            logging.info("Deleting room server %s" % server.hostname)
+            server.key.delete()
+        elif silence > stale_after and server.available:
+            logging.warn("Room server %s stopped heartbeating" % server.hostname)
+            server.available = False
+            server.put()
 
 
 class RegionalRoomServer(ndb.Model):
     name = ndb.StringProperty('name', indexed=True)
     hostname = ndb.StringProperty('hostname', indexed=True)
 
+    # reported by the server itself in each heartbeat
+    occupancy = ndb.IntegerProperty('occupancy', indexed=False, default=0)
+    capacity = ndb.IntegerProperty('capacity', indexed=False)
+    last_heartbeat = ndb.DateTimeProperty('last_heartbeat', indexed=False)
+
+    # False while the server is silent or too full to take new players
+    available = ndb.BooleanProperty('available', indexed=False, default=True)
+
+    # fraction of capacity in use; 0 for servers that don't report capacity
+    def load(self):
+        if not self.capacity:
+            return 0.0
+        return float(self.occupancy or 0) / self.capacity
+
+    # the part of the entity /config.js depends on
+    def _directory_state(self):
+        return ( self.name, self.hostname, self.available )
+
+    @classmethod
+    def _post_get_hook(cls, key, future):
+        server = future.get_result()
+        if server is not None:
+            server._loaded_state = server._directory_state()
+
+    # a write that changes what /config.js should contain invalidates it;
+    # plain heartbeats, which only move occupancy around, don't.
+    def _post_put_hook(self, future):
+        state = self._directory_state()
+        if getattr(self, '_loaded_state', None) != state:
+            config_cache.invalidate()
+        self._loaded_state = state
+
+    @classmethod
+    def _post_delete_hook(cls, key, future):
+        config_cache.invalidate()
+
+
+# routes the country named by the entity's key id (e.g. 'TR') to another
+# region, without having to deploy a new country_regions.csv
+class CountryRegionOverride(ndb.Model):
+    region = ndb.StringProperty('region', indexed=False)
+
+    # other instances pick the change up within _overrides_ttl
+    def _post_put_hook(self, future):
+        _overrides['loaded_at'] = 0
+
+    @classmethod
+    def _post_delete_hook(cls, key, future):
+        _overrides['loaded_at'] = 0
+
 
 if __name__ == "__main__":
     if len( sys.argv ) == 2:
-        print get_server_for_country( sys.argv[ 1 ] )
+        print get_region_for_country( sys.argv[ 1 ] )
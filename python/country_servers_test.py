@@ -0,0 +1,214 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for country_servers."""
+
+import datetime
+import unittest2
+
+import config_cache
+import country_servers
+
+from google.appengine.ext import testbed
+
+
+class CountryServersTest(unittest2.TestCase):
+  """Test cases for country_servers."""
+
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_datastore_v3_stub()
+    self.testbed.init_memcache_stub()
+    country_servers._overrides['loaded_at'] = 0
+
+  def tearDown(self):
+    self.testbed.deactivate()
+
+  def testTableIsLoadedFromDataFile(self):
+    self.assertEqual(country_servers.us,
+                     country_servers.get_region_for_country('US'))
+    self.assertEqual(country_servers.europe,
+                     country_servers.get_region_for_country('fr'))
+    self.assertEqual(country_servers.asia,
+                     country_servers.get_region_for_country('JP'))
+
+  def testUnknownOrMissingCountryFallsBackToDefault(self):
+    for country in (None, '', 'XX', '??'):
+      self.assertEqual(country_servers.default_region,
+                       country_servers.get_region_for_country(country))
+
+  def testOverrideTakesPrecedence(self):
+    self.assertEqual(country_servers.europe,
+                     country_servers.get_region_for_country('TR'))
+    country_servers.CountryRegionOverride(
+        id='TR', region=country_servers.asia).put()
+    self.assertEqual(country_servers.asia,
+                     country_servers.get_region_for_country('TR'))
+
+  def testOverrideLoadFailureDoesNotRaise(self):
+    query = country_servers.CountryRegionOverride.query
+
+    def _Fail():
+      raise RuntimeError('datastore unavailable')
+
+    country_servers.CountryRegionOverride.query = staticmethod(_Fail)
+    try:
+      self.assertEqual(country_servers.us,
+                       country_servers.get_region_for_country('US'))
+    finally:
+      country_servers.CountryRegionOverride.query = query
+
+
+
+class DirectoryTest(unittest2.TestCase):
+  """Test cases for the room server directory."""
+
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_datastore_v3_stub()
+    self.testbed.init_memcache_stub()
+    self.invalidations = 0
+    self._invalidate = config_cache.invalidate
+    config_cache.invalidate = self._CountInvalidation
+
+  def tearDown(self):
+    config_cache.invalidate = self._invalidate
+    self.testbed.deactivate()
+
+  def _CountInvalidation(self):
+    self.invalidations += 1
+
+  def _Hostnames(self):
+    return sorted(s.hostname for s in country_servers.get_all_servers())
+
+  def testReadingEmptyDirectoryDoesNotWrite(self):
+    self.assertEqual([], country_servers.get_all_servers())
+    self.assertEqual(0, country_servers.RegionalRoomServer.query().count())
+
+  def testBootstrapIsIdempotent(self):
+    self.assertIsNotNone(country_servers.bootstrap_directory())
+    self.assertIsNone(country_servers.bootstrap_directory())
+    servers = country_servers.get_all_servers()
+    self.assertEqual(1, len(servers))
+    self.assertEqual(country_servers.default_region, servers[0].name)
+
+  def testBootstrapLeavesPopulatedDirectoryAlone(self):
+    country_servers.record_heartbeat('asia', 'a.example.com', 10, 100)
+    self.assertIsNone(country_servers.bootstrap_directory())
+    self.assertEqual(['a.example.com'], self._Hostnames())
+
+  def testHeartbeatRegistersServer(self):
+    country_servers.record_heartbeat('us', 'a.example.com', 10, 100)
+    country_servers.record_heartbeat('europe', 'b.example.com', 10, 100)
+    self.assertEqual(['a.example.com', 'b.example.com'], self._Hostnames())
+    server = country_servers.RegionalRoomServer.get_by_id('a.example.com')
+    self.assertEqual(10, server.occupancy)
+    self.assertEqual(100, server.capacity)
+
+  def testHeartbeatAdoptsHandMadeEntity(self):
+    country_servers.RegionalRoomServer(name='us',
+                                       hostname='a.example.com').put()
+    country_servers.record_heartbeat('us', 'a.example.com', 10, 100)
+    self.assertEqual(['a.example.com'], self._Hostnames())
+
+  def testOverloadedServerIsExcludedWithHysteresis(self):
+    country_servers.record_heartbeat('us', 'a.example.com', 10, 100)
+    country_servers.record_heartbeat('europe', 'b.example.com', 95, 100)
+    self.assertEqual(['a.example.com'], self._Hostnames())
+    # Between the thresholds it stays out...
+    country_servers.record_heartbeat('europe', 'b.example.com', 85, 100)
+    self.assertEqual(['a.example.com'], self._Hostnames())
+    # ...until it has drained.
+    country_servers.record_heartbeat('europe', 'b.example.com', 50, 100)
+    self.assertEqual(['a.example.com', 'b.example.com'], self._Hostnames())
+
+  def testEverythingIsListedWhenNothingIsAvailable(self):
+    country_servers.record_heartbeat('us', 'a.example.com', 100, 100)
+    self.assertEqual(['a.example.com'], self._Hostnames())
+
+  def testPlainHeartbeatDoesNotInvalidateConfig(self):
+    country_servers.record_heartbeat('us', 'a.example.com', 10, 100)
+    self.assertEqual(1, self.invalidations)
+    country_servers.record_heartbeat('us', 'a.example.com', 20, 100)
+    self.assertEqual(1, self.invalidations)
+    country_servers.record_heartbeat('us', 'a.example.com', 95, 100)
+    self.assertEqual(2, self.invalidations)
+
+  def testSweepDropsSilentServers(self):
+    country_servers.record_heartbeat('us', 'a.example.com', 10, 100)
+    country_servers.record_heartbeat('us', 'b.example.com', 10, 100)
+    country_servers.record_heartbeat('us', 'gone.example.com', 10, 100)
+    now = datetime.datetime.utcnow()
+    silent = country_servers.RegionalRoomServer.get_by_id('b.example.com')
+    silent.last_heartbeat = now - datetime.timedelta(minutes=5)
+    silent.put()
+    gone = country_servers.RegionalRoomServer.get_by_id('gone.example.com')
+    gone.last_heartbeat = now - datetime.timedelta(days=2)
+    gone.put()
+
+    country_servers.sweep_stale_servers()
+    self.assertEqual(['a.example.com'], self._Hostnames())
+    self.assertIsNone(
+        country_servers.RegionalRoomServer.get_by_id('gone.example.com'))
+
+  def testServerIsListedAgainWhenItResumesHeartbeating(self):
+    country_servers.record_heartbeat('us', 'a.example.com', 10, 100)
+    country_servers.record_heartbeat('us', 'b.example.com', 10, 100)
+    silent = country_servers.RegionalRoomServer.get_by_id('b.example.com')
+    silent.last_heartbeat -= datetime.timedelta(minutes=5)
+    silent.put()
+    country_servers.sweep_stale_servers()
+    self.assertEqual(['a.example.com'], self._Hostnames())
+    # Back between the thresholds, it is healthy and not coming off overload.
+    country_servers.record_heartbeat('us', 'b.example.com', 85, 100)
+    self.assertTrue(
+        country_servers.RegionalRoomServer.get_by_id('b.example.com').available)
+    self.assertEqual(['a.example.com', 'b.example.com'], self._Hostnames())
+
+  def testAvailableRegionFallsBackToLeastLoaded(self):
+    country_servers.record_heartbeat('us', 'a.example.com', 70, 100)
+    country_servers.record_heartbeat('asia', 'b.example.com', 20, 100)
+    country_servers.record_heartbeat('asia', 'c.example.com', 60, 100)
+    country_servers.record_heartbeat('europe', 'd.example.com', 95, 100)
+    directory = country_servers.get_directory()
+    self.assertEqual('us',
+                     country_servers.get_available_region('us', directory))
+    self.assertEqual('asia',
+                     country_servers.get_available_region('europe', directory))
+
+  def testDirectoryPoolsHostsByRegion(self):
+    for i in range(12):
+      country_servers.RegionalRoomServer(
+          name='us', hostname='us-%02d.example.com' % i).put()
+    country_servers.RegionalRoomServer(name='asia',
+                                       hostname='asia.example.com').put()
+    pools = country_servers.get_directory()['pools']
+    self.assertEqual(['asia.example.com'], pools['asia'])
+    self.assertEqual(12, len(pools['us']))
+
+  def testClientsAreSpreadAcrossRegionPool(self):
+    for i in range(4):
+      country_servers.RegionalRoomServer(
+          name='us', hostname='us-%d.example.com' % i).put()
+    directory = country_servers.get_directory()
+    assigned = set(country_servers.assign_hosts(directory, 'client-%d' % i)['us']
+                   for i in range(200))
+    self.assertEqual(set(directory['pools']['us']), assigned)
+    self.assertEqual(country_servers.assign_hosts(directory, 'client-1'),
+                     country_servers.assign_hosts(directory, 'client-1'))
+
+
+if __name__ == '__main__':
+  unittest2.main()
@@ -0,0 +1,279 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Aggregated Content Security Policy violation reports.
+
+A policy mistake in a deploy makes every page view send a report, nearly all
+of them the same violation.  Reports are therefore reduced to a fingerprint,
+the violated directive, the origin of the blocked resource and the file that
+tried to load it, and only counted.
+
+Each instance counts fingerprints locally and hands the counts to a task in
+batches; the task adds them to one CspViolation entity per fingerprint.  Each
+batch has an id, which the entities it was added to keep for a while, so that
+a retried task does not count the same batch twice.  Only
+a sample of reports is logged: the 1st, 2nd, 4th, 8th... of each fingerprint
+seen by an instance between flushes.
+"""
+
+import datetime
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import urlparse
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+# Served by handlers.CspFlushHandler; see _TASK_ROUTES in main.py.
+FLUSH_URL = '/tasks/csp/flush'
+
+# Local counts are handed to a task after this many seconds or reports,
+# whichever comes first.
+_FLUSH_INTERVAL = 30
+_FLUSH_REPORTS = 500
+
+# A CspViolation keeps the ids of this many of the batches last added to it.
+# A retried task is normally run again long before its violations see as
+# many other batches.
+_RECENT_BATCHES = 100
+
+# Fingerprint fields are cut to this many characters.
+_MAX_FIELD_LENGTH = 256
+
+# The csp-report members that are kept, and their types; anything else in a
+# report is dropped.
+_REPORT_FIELDS = {
+    'document-uri': basestring,
+    'referrer': basestring,
+    'violated-directive': basestring,
+    'effective-directive': basestring,
+    'original-policy': basestring,
+    'disposition': basestring,
+    'blocked-uri': basestring,
+    'source-file': basestring,
+    'script-sample': basestring,
+    'line-number': (int, long),
+    'column-number': (int, long),
+    'status-code': (int, long),
+}
+
+# Longer string fields are cut to this many characters.
+_MAX_REPORT_FIELD_LENGTH = 1024
+
+# Blocked URIs with these schemes are reduced to their origin.  Any other value
+# is a keyword such as 'inline', 'eval' or a bare scheme like 'data'.
+_ORIGIN_SCHEMES = frozenset(['http', 'https', 'ws', 'wss'])
+
+# The top violations are read from memcache until the next flush is stored.
+_TOP_KEY = 'csp_top'
+_TOP_TTL = 60
+MAX_TOP_VIOLATIONS = 100
+
+_lock = threading.Lock()
+
+# fingerprint -> number of reports not yet handed to a task.
+_pending = {}
+_pending_state = {'reports': 0, 'flushed_at': time.time()}
+
+
+def _Truncate(value):
+  if not isinstance(value, basestring):
+    return ''
+  return value[:_MAX_FIELD_LENGTH]
+
+
+def _StripQuery(uri):
+  return uri.split('#', 1)[0].split('?', 1)[0]
+
+
+def fingerprint(report):
+  """Returns the (directive, blocked origin, source file) of a csp-report."""
+  directive = (report.get('effective-directive') or
+               report.get('violated-directive') or '')
+  if isinstance(directive, basestring):
+    # CSP 1 browsers report the whole directive, sources and all.
+    directive = directive.split(' ', 1)[0]
+
+  blocked = report.get('blocked-uri') or ''
+  if isinstance(blocked, basestring):
+    parsed = urlparse.urlsplit(blocked)
+    if parsed.scheme in _ORIGIN_SCHEMES and parsed.netloc:
+      blocked = '%s://%s' % (parsed.scheme, parsed.netloc)
+    elif parsed.scheme:
+      blocked = parsed.scheme
+
+  source = report.get('source-file') or ''
+  if isinstance(source, basestring):
+    source = _StripQuery(source)
+
+  return (_Truncate(directive), _Truncate(blocked), _Truncate(source))
+
+
+def parse(body):
+  """Returns the known csp-report fields of a report body as a dict.
+
+  Raises ValueError if body is not a JSON object with a csp-report object.
+  """
+  # Anything else would be rejected by the parser, only later.
+  if not body.lstrip().startswith('{'):
+    raise ValueError('CSP report is not a JSON object')
+  try:
+    report = json.loads(body)['csp-report']
+  except (KeyError, TypeError, RuntimeError):
+    # RuntimeError is the parser running out of stack on deeply nested input.
+    raise ValueError('CSP report has no csp-report object')
+  if not isinstance(report, dict):
+    raise ValueError('csp-report is not an object')
+
+  fields = {}
+  for (name, kind) in _REPORT_FIELDS.iteritems():
+    value = report.get(name)
+    if isinstance(value, bool) or not isinstance(value, kind):
+      continue
+    if isinstance(value, basestring):
+      value = value[:_MAX_REPORT_FIELD_LENGTH]
+    fields[name] = value
+  return fields
+
+
+def _IsPowerOfTwo(n):
+  return n & (n - 1) == 0
+
+
+def record(report):
+  """Counts one csp-report dict, logging it if it falls in the sample."""
+  key = fingerprint(report)
+  with _lock:
+    count = _pending.get(key, 0) + 1
+    _pending[key] = count
+    _pending_state['reports'] += 1
+    now = time.time()
+    if (_pending_state['reports'] < _FLUSH_REPORTS and
+        now - _pending_state['flushed_at'] < _FLUSH_INTERVAL):
+      pending = None
+    else:
+      pending = dict(_pending)
+      _pending.clear()
+      _pending_state['reports'] = 0
+      _pending_state['flushed_at'] = now
+
+  if _IsPowerOfTwo(count):
+    logging.warn('CSP Violation (%d like it on this instance): %s' %
+                 (count, json.dumps(report)))
+  if pending:
+    _Flush(pending)
+
+
+def _Flush(pending):
+  """Hands pending counts to a task, which stores them with store()."""
+  payload = json.dumps({'batch': os.urandom(16).encode('hex'),
+                        'counts': [list(key) + [count]
+                                   for (key, count) in pending.iteritems()]})
+  try:
+    taskqueue.add(url=FLUSH_URL, payload=payload)
+  except taskqueue.Error:
+    # The counts are lost, but the reports behind them are still coming in.
+    logging.exception('Could not enqueue CSP violation counts')
+
+
+def _ViolationId(key):
+  return hashlib.sha1('\n'.join(key).encode('utf-8')).hexdigest()
+
+
+@ndb.transactional
+def _Add(key, count, batch, now):
+  violation = CspViolation.get_by_id(_ViolationId(key))
+  if violation is None:
+    (directive, blocked_origin, source_file) = key
+    violation = CspViolation(id=_ViolationId(key), directive=directive,
+                             blocked_origin=blocked_origin,
+                             source_file=source_file, count=0, first_seen=now)
+  elif batch in violation.recent_batches:
+    return
+  violation.count += count
+  violation.last_seen = now
+  violation.recent_batches = (violation.recent_batches +
+                              [batch])[-_RECENT_BATCHES:]
+  violation.put()
+
+
+def _Parse(payload):
+  """Returns the (batch id, [(key, count)]) in a payload written by _Flush.
+
+  Raises ValueError if the payload is malformed.
+  """
+  batch = json.loads(payload)
+  if (not isinstance(batch, dict) or
+      not isinstance(batch.get('batch'), basestring) or not batch['batch'] or
+      not isinstance(batch.get('counts'), list)):
+    raise ValueError('invalid CSP violation batch')
+  counts = []
+  for entry in batch['counts']:
+    if (not isinstance(entry, list) or len(entry) != 4 or
+        not all(isinstance(field, basestring) for field in entry[:3]) or
+        not isinstance(entry[3], (int, long)) or entry[3] <= 0):
+      raise ValueError('invalid CSP violation count')
+    counts.append((tuple(entry[:3]), entry[3]))
+  return (batch['batch'], counts)
+
+
+def store(payload):
+  """Adds the counts in a task payload written by _Flush to the Datastore.
+
+  Nothing is written unless the whole payload is valid, and storing a
+  payload again, as a retried task does, only adds the counts which did not
+  make it the first time.  Raises ValueError if the payload is malformed.
+  """
+  (batch, counts) = _Parse(payload)
+  now = datetime.datetime.utcnow()
+  for (key, count) in counts:
+    _Add(key, count, batch, now)
+  memcache.delete(_TOP_KEY)
+
+
+def top_violations(limit=20):
+  """Returns the most reported violations as a list of dicts, most first.
+
+  At most MAX_TOP_VIOLATIONS are returned.
+  """
+  top = memcache.get(_TOP_KEY)
+  if top is not None:
+    return top[:limit]
+
+  top = [{'directive': v.directive,
+          'blocked_origin': v.blocked_origin,
+          'source_file': v.source_file,
+          'count': v.count,
+          'first_seen': v.first_seen.isoformat(),
+          'last_seen': v.last_seen.isoformat()}
+         for v in CspViolation.query().order(-CspViolation.count).fetch(
+             MAX_TOP_VIOLATIONS)]
+  memcache.set(_TOP_KEY, top, time=_TOP_TTL)
+  return top[:limit]
+
+
+class CspViolation(ndb.Model):
+  """The number of reports received with one fingerprint."""
+  directive = ndb.StringProperty(indexed=False)
+  blocked_origin = ndb.StringProperty(indexed=False)
+  source_file = ndb.StringProperty(indexed=False)
+  count = ndb.IntegerProperty(default=0)
+  first_seen = ndb.DateTimeProperty(indexed=False)
+  last_seen = ndb.DateTimeProperty(indexed=False)
+  # Ids of the last _RECENT_BATCHES batches added, oldest first.
+  recent_batches = ndb.StringProperty(repeated=True, indexed=False)
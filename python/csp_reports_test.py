@@ -0,0 +1,205 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for csp_reports."""
+
+import json
+
+import unittest2
+import webob
+
+import csp_reports
+import main
+
+from google.appengine.ext import testbed
+
+
+def _Report(directive='script-src', blocked='https://evil.example.com/x.js',
+            source='https://forest.example.com/js/main.js?v=1'):
+  return {'violated-directive': directive, 'blocked-uri': blocked,
+          'source-file': source}
+
+
+class FingerprintTest(unittest2.TestCase):
+  """Test cases for csp_reports.fingerprint."""
+
+  def testReportsAreReducedToOrigins(self):
+    self.assertEqual(
+        ('script-src', 'https://evil.example.com',
+         'https://forest.example.com/js/main.js'),
+        csp_reports.fingerprint(_Report()))
+
+  def testKeywordsAndCsp1Directives(self):
+    report = _Report(directive='script-src \'self\' https:', blocked='inline')
+    self.assertEqual(('script-src', 'inline'),
+                     csp_reports.fingerprint(report)[:2])
+    report = _Report(blocked='data:image/png;base64,AAAA')
+    self.assertEqual('data', csp_reports.fingerprint(report)[1])
+
+  def testEffectiveDirectiveWins(self):
+    report = _Report()
+    report['effective-directive'] = 'script-src-elem'
+    self.assertEqual('script-src-elem', csp_reports.fingerprint(report)[0])
+
+  def testMalformedFieldsAreEmpty(self):
+    report = {'violated-directive': 7, 'blocked-uri': ['x'],
+              'source-file': 'x' * 1000}
+    self.assertEqual(('', '', 'x' * csp_reports._MAX_FIELD_LENGTH),
+                     csp_reports.fingerprint(report))
+
+
+class ParseTest(unittest2.TestCase):
+  """Test cases for csp_reports.parse."""
+
+  def testOnlyKnownFieldsOfTheRightTypeAreKept(self):
+    body = json.dumps({'csp-report': {
+        'blocked-uri': 'inline', 'line-number': 3, 'status-code': True,
+        'source-file': ['x'], 'script-sample': 'x' * 5000, 'extra': 'y'}})
+    report = csp_reports.parse(body)
+    self.assertEqual(['blocked-uri', 'line-number', 'script-sample'],
+                     sorted(report))
+    self.assertEqual(csp_reports._MAX_REPORT_FIELD_LENGTH,
+                     len(report['script-sample']))
+
+  def testMalformedReportsRaiseValueError(self):
+    for body in ('', 'null', '[1]', '{"csp-report": 1}', '{"other": {}}',
+                 '{"csp-report": {}', '{"a":' * 100000):
+      self.assertRaises(ValueError, csp_reports.parse, body)
+
+
+class CspReportsTest(unittest2.TestCase):
+  """Test cases for counting, flushing and listing violations."""
+
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_datastore_v3_stub()
+    self.testbed.init_memcache_stub()
+    self.testbed.init_taskqueue_stub()
+    self.taskqueue = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+    csp_reports._pending.clear()
+    csp_reports._pending_state['reports'] = 0
+    csp_reports._pending_state['flushed_at'] = 0
+
+  def tearDown(self):
+    self.testbed.deactivate()
+
+  def _RunTasks(self):
+    for task in self.taskqueue.get_filtered_tasks(url=csp_reports.FLUSH_URL):
+      request = webob.Request.blank(task.url, POST=task.payload,
+                                    headers=[('X-AppEngine-QueueName',
+                                              'default')])
+      self.assertEqual(200, request.get_response(main.app).status_int)
+    self.taskqueue.FlushQueue('default')
+
+  def testCountsAreBatchedIntoTasks(self):
+    csp_reports._pending_state['flushed_at'] = 2 ** 40
+    for _ in range(csp_reports._FLUSH_REPORTS - 1):
+      csp_reports.record(_Report())
+    self.assertEqual([], self.taskqueue.get_filtered_tasks())
+    csp_reports.record(_Report(blocked='eval'))
+    tasks = self.taskqueue.get_filtered_tasks()
+    self.assertEqual(1, len(tasks))
+    counts = sorted(entry[3] for entry in
+                    json.loads(tasks[0].payload)['counts'])
+    self.assertEqual([1, csp_reports._FLUSH_REPORTS - 1], counts)
+    self.assertEqual({}, csp_reports._pending)
+
+  def _RecordAndFlush(self, reports):
+    csp_reports._pending_state['flushed_at'] = 2 ** 40
+    for report in reports:
+      csp_reports.record(report)
+    csp_reports._Flush(dict(csp_reports._pending))
+    csp_reports._pending.clear()
+    self._RunTasks()
+
+  def testTopViolationsAreStoredAndListed(self):
+    self._RecordAndFlush([_Report(), _Report()])
+    self._RecordAndFlush([_Report(), _Report(blocked='inline')])
+
+    top = csp_reports.top_violations()
+    self.assertEqual([3, 1], [v['count'] for v in top])
+    self.assertEqual('https://evil.example.com', top[0]['blocked_origin'])
+    self.assertEqual(top[:1], csp_reports.top_violations(1))
+
+    self._RecordAndFlush([_Report(blocked='inline')] * 2)
+    self.assertEqual([3, 3], [v['count'] for v in
+                              csp_reports.top_violations()])
+
+  def testMalformedBatchesAreRejected(self):
+    for counts in ('{}', '[["a", "b", "c", -1]]', '[["a", "b", 1, 1]]'):
+      self.assertRaises(ValueError, csp_reports.store,
+                        '{"batch": "1", "counts": [%s]}' % counts)
+    for payload in ('[]', '{"counts": []}', '{"batch": "", "counts": []}'):
+      self.assertRaises(ValueError, csp_reports.store, payload)
+
+  def testNothingIsStoredFromAMalformedBatch(self):
+    payload = json.dumps({'batch': '1', 'counts': [['a', 'b', 'c', 2],
+                                                   ['a', 'b', 'c', 0]]})
+    self.assertRaises(ValueError, csp_reports.store, payload)
+    self.assertEqual([], csp_reports.top_violations())
+
+  def testRetriedBatchesAreCountedOnce(self):
+    payload = json.dumps({'batch': '1', 'counts': [['a', 'b', 'c', 2],
+                                                   ['a', 'b', 'd', 1]]})
+    csp_reports.store(payload)
+    csp_reports.store(payload)
+    self.assertEqual([2, 1], [v['count'] for v in
+                              csp_reports.top_violations()])
+    csp_reports.store(json.dumps({'batch': '2',
+                                  'counts': [['a', 'b', 'c', 3]]}))
+    self.assertEqual([5, 1], [v['count'] for v in
+                              csp_reports.top_violations()])
+
+  def testPartlyStoredBatchesAreFinishedOnRetry(self):
+    add = csp_reports._Add
+    self.addCleanup(setattr, csp_reports, '_Add', add)
+    def FailOnSecond(key, *args):
+      if key[2] == 'd':
+        raise RuntimeError('transaction failed')
+      add(key, *args)
+    csp_reports._Add = FailOnSecond
+    payload = json.dumps({'batch': '1', 'counts': [['a', 'b', 'c', 2],
+                                                   ['a', 'b', 'd', 1]]})
+    self.assertRaises(RuntimeError, csp_reports.store, payload)
+    csp_reports._Add = add
+    csp_reports.store(payload)
+    self.assertEqual([2, 1], [v['count'] for v in
+                              csp_reports.top_violations()])
+
+  def testCspEndpointCountsReports(self):
+    body = json.dumps({'csp-report': _Report()})
+    response = webob.Request.blank(
+        '/csp', POST=body,
+        content_type='application/csp-report').get_response(main.app)
+    self.assertEqual(200, response.status_int)
+    self.assertEqual(1, len(self.taskqueue.get_filtered_tasks()))
+
+  def testViolationsEndpointRequiresAdmin(self):
+    self.testbed.setup_env(user_email='someone@example.com', user_id='1',
+                           user_is_admin='0', overwrite=True)
+    self.testbed.init_user_stub()
+    response = webob.Request.blank('/admin/csp/violations').get_response(
+        main.app)
+    self.assertEqual(403, response.status_int)
+
+    self.testbed.setup_env(user_is_admin='1', overwrite=True)
+    self._RecordAndFlush([_Report()])
+    response = webob.Request.blank('/admin/csp/violations').get_response(
+        main.app)
+    self.assertEqual(200, response.status_int)
+    self.assertIn('evil.example.com', response.body)
+
+
+if __name__ == '__main__':
+  unittest2.main()
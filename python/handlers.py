@@ -11,35 +11,321 @@
 #     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #     See the License for the specific language governing permissions and
 #     limitations under the License.
+import binascii
+import hashlib
 import json
 import logging
+import os
+import config_cache
 import country_servers
+import csp_reports
+import latency
 
+from base import compression
 from base import handlers
+from base import microcache
+from base import profiler
+from base import timing
+
+# Default for the 'config_max_age' app config setting, in seconds.
+_DEFAULT_CONFIG_MAX_AGE = 300
+
+# Default for the 'csp_report_max_bytes' app config setting.
+_DEFAULT_CSP_REPORT_MAX_BYTES = 8 * 1024
+
+# Content types browsers send CSP reports with.
+_CSP_REPORT_CONTENT_TYPES = frozenset(['application/csp-report',
+                                       'application/json'])
+
+# Identifies a browser for room server host assignment.
+_CLIENT_ID_COOKIE = 'forest_client'
+_CLIENT_ID_MAX_AGE = 365 * 24 * 60 * 60
+
+# Remembers the region picked for a browser, signed so it can be trusted when
+# it comes back, for this many seconds.
+_REGION_HINT_COOKIE = 'forest_region'
+_REGION_HINT_MAX_AGE = 60 * 60
 
 # Minimal set of handlers to let you display main page with examples
 class RootHandler(handlers.BaseHandler):
 
+  # Signed out visitors are answered from memory for a minute at a time.
+  # The page ignores the query string, so requests with one are not cached:
+  # the cache is keyed on it, and random ones would evict the real page.
+  response_cache = microcache.ResponseCache(
+      ttl=60, variant=lambda request: None if request.query_string else '')
+
   def get(self):
+    # the page only changes per request in its CSP nonce and XSRF token
+    self.render_static('index.html')
+
+class WarmupHandler(handlers.BaseHandler):
+  """Primes a new instance before App Engine sends it user traffic.
+
+  Compiles the page templates, loads the XSRF key, the country region
+  overrides and the room server directory, so the first real request runs
+  as fast as a steady-state one.
+  """
 
-    self.render('index.html')
+  def get(self):
+    self.warm_up(['index.html', 'config.template'])
+    country_servers.bootstrap_directory()
+    country_servers.get_region_for_country(country_servers.default_region)
+    config_cache.get('directory', country_servers.get_directory)
 
 class ConfigHandler(handlers.BaseHandler):
 
   def get(self):
-    servers = country_servers.get_all_servers()
-    country = self.request.headers.get("X-AppEngine-Country")
-    region = country_servers.get_region_for_country(country)
+    client_id = self._get_client_id()
+    country = self.request.headers.get("X-AppEngine-Country") or ''
+    # returning players keep the region they were given, so it doesn't
+    # change under them between reloads as latency measurements come in
+    region = self._get_region_hint(client_id, country)
+    if region is None:
+      # measured latency wins once enough clients from this country reported it
+      region = (latency.best_region(country) or
+                country_servers.get_region_for_country(country))
+      self._set_region_hint(client_id, country, region)
+
+    directory = config_cache.get('directory', country_servers.get_directory)
+    # send players to another region while this one is full or down
+    region = country_servers.get_available_region(region, directory)
+    hosts = country_servers.assign_hosts(directory, client_id)
+
+    # There is one payload per default region and host assignment, kept
+    # along with its compressed forms if responses are compressed here.
+    key = ' '.join(['config.js', region] +
+                   ['%s=%s' % item for item in sorted(hosts.items())])
+    compress = self._CompressResponses()
+    (etag, variants) = config_cache.get(
+        key + (' compressed' if compress else ''),
+        lambda: self._render_config(key, region, hosts, compress))
 
+    max_age = self.app.config.get('config_max_age', _DEFAULT_CONFIG_MAX_AGE)
+    # The host assignment depends on the client id cookie, so the payload is
+    # specific to this client: private keeps shared caches from storing it,
+    # and Vary names everything it depends on for the browser's own cache.
+    self.response.headers['Cache-Control'] = 'private, max-age=%d' % max_age
+    self.response.headers['Vary'] = 'X-AppEngine-Country, Cookie'
     self.response.headers['Content-Type'] = 'application/javascript; charset=utf-8'
-    self.render('config.template', { 'default_region': region, 'servers': servers })
+    # The payload holds no per-request values, so it is written from the cache
+    # rather than going through render().  This answers If-None-Match too.
+    self.write_variants(variants, etag)
+
+  def _get_client_id(self):
+    client_id = self.request.cookies.get(_CLIENT_ID_COOKIE)
+    if not client_id or len(client_id) > 64:
+      client_id = binascii.hexlify(os.urandom(16))
+      self.response.set_cookie(_CLIENT_ID_COOKIE, client_id,
+                               max_age=_CLIENT_ID_MAX_AGE)
+    return client_id
+
+  # the hint only holds for the browser and country it was made for, so a
+  # player who travels is placed again
+  def _get_region_hint(self, client_id, country):
+    hint = self.request.cookies.get(_REGION_HINT_COOKIE)
+    if not hint or '/' not in hint:
+      return None
+    region, token = hint.split('/', 1)
+    if not handlers.ValidateSignedToken(client_id, token,
+                                        'region %s %s' % (country, region),
+                                        max_age=_REGION_HINT_MAX_AGE):
+      return None
+    return region
+
+  def _set_region_hint(self, client_id, country, region):
+    token = handlers.GenerateSignedToken(client_id,
+                                         'region %s %s' % (country, region))
+    # the cookie outlives the token by up to a timestamp bucket; stale
+    # tokens are simply replaced
+    self.response.set_cookie(_REGION_HINT_COOKIE, '%s/%s' % (region, token),
+                             max_age=_REGION_HINT_MAX_AGE)
+
+  def _render_config(self, key, region, hosts, compress):
+    """Returns an (etag, variants) tuple for a cache key and what it encodes.
+
+    variants holds the body in each encoding, or only unencoded without
+    compress; see compression.Variants().
+    """
+    # A new deploy may change the template, so it changes the ETag too.
+    digest = hashlib.sha1(os.environ.get('CURRENT_VERSION_ID', ''))
+    digest.update(key)
+    servers = [{ 'name': name, 'hostname': hostname }
+               for (name, hostname) in sorted(hosts.items())]
+    body = self.render_to_string('config.template',
+                                 { 'default_region': region, 'servers': servers })
+    return (digest.hexdigest(),
+            compression.Variants(body.encode('utf-8'), compress))
 
 class CspHandler(handlers.BaseAjaxHandler):
+  """Counts Content Security Policy violation reports sent by browsers.
+
+  Anyone can post here, so requests are rejected as cheaply as possible: by
+  content type, then by Content-Length, before any of the body is read.
+  """
+
+  def post(self):
+    if self.request.content_type not in _CSP_REPORT_CONTENT_TYPES:
+      self._reject(415, 'unsupported CSP report type')
+      return
+
+    max_bytes = self.app.config.get('csp_report_max_bytes',
+                                    _DEFAULT_CSP_REPORT_MAX_BYTES)
+    length = self.request.content_length
+    if length is not None and length > max_bytes:
+      self._reject(413, 'CSP report too large')
+      return
+    # Read the stream directly, so at most max_bytes are ever buffered even
+    # without a Content-Length.
+    body = self.request.body_file_raw.read(
+        length if length is not None else max_bytes + 1)
+    if len(body) > max_bytes:
+      self._reject(413, 'CSP report too large')
+      return
+
+    try:
+      report = csp_reports.parse(body)
+    except ValueError:
+      self._reject(400, 'invalid CSP report')
+      return
+    csp_reports.record(report)
+    self.render_json({})
+
+  def _reject(self, status, error):
+    self.response.set_status(status)
+    self.render_json({'error': error})
+
+class CspFlushHandler(handlers.BaseTaskHandler):
+  """Stores a batch of CSP violation counts enqueued by csp_reports."""
+
+  def post(self):
+    try:
+      csp_reports.store(self.request.body)
+    except ValueError:
+      # retrying a malformed batch would never succeed
+      logging.exception('Dropping invalid CSP violation counts')
+
+class CspViolationsHandler(handlers.AdminAjaxHandler):
+  """Lists the most reported CSP violations, most reported first.
+
+  Takes an optional limit parameter, at most
+  csp_reports.MAX_TOP_VIOLATIONS.
+  """
+
+  def get(self):
+    try:
+      limit = int(self.request.get('limit', 20))
+    except ValueError:
+      limit = 20
+    limit = min(max(limit, 1), csp_reports.MAX_TOP_VIOLATIONS)
+    self.render_json({'violations': csp_reports.top_violations(limit)})
+
+  def DenyAccess(self):
+    self.response.set_status(403)
+    self.render_json({'error': 'administrator access required'})
+
+  def XsrfFail(self):
+    self.response.set_status(403)
+    self.render_json({'error': 'invalid XSRF token'})
+
+class TimingHandler(handlers.AdminAjaxHandler):
+  """Summarizes how long this instance has spent in each phase of requests.
+
+  See base.timing; durations are in milliseconds.
+  """
+
+  def get(self):
+    self.render_json({'spans': timing.Histograms()})
+
+  def DenyAccess(self):
+    self.response.set_status(403)
+    self.render_json({'error': 'administrator access required'})
+
+  def XsrfFail(self):
+    self.response.set_status(403)
+    self.render_json({'error': 'invalid XSRF token'})
+
+class ProfileHandler(handlers.AdminAjaxHandler):
+  """Returns the stacks sampled on this instance, and a profiler token.
+
+  The stacks are in the collapsed format of flame graph tools; see
+  base.profiler.  Requests sent with the token in the header named by
+  'header' are profiled too, for an hour after it is made.
+  """
+
+  def get(self):
+    self.render_json({'header': handlers.PROFILER_TOKEN_HEADER,
+                      'token': handlers.GenerateProfilerToken(),
+                      'samples': profiler.Samples(),
+                      'stacks': profiler.Collapsed()})
+
+  def DenyAccess(self):
+    self.response.set_status(403)
+    self.render_json({'error': 'administrator access required'})
+
+  def XsrfFail(self):
+    self.response.set_status(403)
+    self.render_json({'error': 'invalid XSRF token'})
+
+class RttHandler(handlers.BaseAjaxHandler):
+  """Records client-measured round trip times to each room server region.
+
+  Expects a JSON body of the form {"rtts": {"<region>": <milliseconds>, ...}}.
+  Regions missing from the room server directory are ignored.
+  """
+
+  def post(self):
+    directory = config_cache.get('directory', country_servers.get_directory)
+    try:
+      rtts = latency.validate_rtts(json.loads(self.request.body)['rtts'],
+                                   directory['pools'])
+    except (ValueError, KeyError, TypeError):
+      self.response.set_status(400)
+      self.render_json({'error': 'invalid RTT report'})
+      return
+
+    country = self.request.headers.get("X-AppEngine-Country")
+    if country:
+      # Clients are told apart by address: the client id cookie is whatever
+      # the client sends, so it would let one client report many times.
+      latency.record(country, rtts, self.request.remote_addr or '')
+    self.render_json({})
+
+class RoomServerHeartbeatHandler(handlers.BaseTaskHandler):
+  """Registers a room server or refreshes its entry in the directory.
+
+  Room servers enqueue a task for this handler about once a minute, with the
+  form parameters name (the region), hostname, occupancy and capacity.
+  """
 
   def post(self):
     try:
-      report = json.loads(self.request.body)
-      logging.warn('CSP Violation: %s' % (json.dumps(report['csp-report'])))
-      self.render_json({})
-    except:
-      self.render_json({'error': 'invalid CSP report'})
+      occupancy = int(self.request.get('occupancy'))
+      capacity = int(self.request.get('capacity'))
+    except ValueError:
+      self.response.set_status(400)
+      return
+    name = self.request.get('name')
+    hostname = self.request.get('hostname')
+    if not name or not hostname or occupancy < 0 or capacity < 0:
+      self.response.set_status(400)
+      return
+
+    country_servers.record_heartbeat(name, hostname, occupancy, capacity)
+
+class XsrfKeyRotationHandler(handlers.BaseCronHandler):
+  """Steps the rotation of the keys XSRF tokens are signed with."""
+
+  def get(self):
+    handlers.RotateXsrfKeys()
+
+class RoomServerSweepHandler(handlers.BaseCronHandler):
+  """Drops room servers that stopped heartbeating from the directory.
+
+  Also seeds the directory with a default server the first time it runs
+  against an empty Datastore.
+  """
+
+  def get(self):
+    country_servers.bootstrap_directory()
+    country_servers.sweep_stale_servers()
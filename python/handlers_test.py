@@ -0,0 +1,415 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for handlers."""
+
+import Cookie
+import json
+import os
+import zlib
+
+import unittest2
+import webob
+
+import config_cache
+import country_servers
+import csp_reports
+import handlers
+import latency
+import main
+
+from google.appengine.ext import testbed
+
+
+def _ResetRateLimits():
+  """Forgets the requests earlier tests made to rate limited routes."""
+  for route in main.app.router.match_routes:
+    if getattr(route, 'rate_limit', None) is not None:
+      route.rate_limit._buckets.clear()
+
+
+def _CompressResponses(test):
+  """Turns on app-side compression until test ends."""
+  # RootHandler's responses are cached whole, compressed or not.
+  test.addCleanup(main.app.config.__setitem__, 'compress_responses',
+                  main.app.config.get('compress_responses'))
+  main.app.config['compress_responses'] = True
+  handlers.RootHandler.response_cache.Clear()
+
+
+class ConfigHandlerTest(unittest2.TestCase):
+  """Test cases for handlers.ConfigHandler."""
+
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_datastore_v3_stub()
+    self.testbed.init_memcache_stub()
+    config_cache._local.clear()
+    _ResetRateLimits()
+    country_servers.RegionalRoomServer(name='us',
+                                       hostname='rooms-us.example.com').put()
+
+  def tearDown(self):
+    self.testbed.deactivate()
+
+  def _Get(self, headers=None, remote_addr='10.0.0.1'):
+    headers = dict(headers or {})
+    headers.setdefault('X-AppEngine-Country', 'US')
+    headers.setdefault('Cookie', 'forest_client=client-1')
+    # webapp2's own get_response() rebuilds the response with its default
+    # Cache-Control: no-cache, so read the WSGI output through plain webob.
+    return webob.Request.blank('/config.js', headers=headers.items(),
+                               remote_addr=remote_addr).get_response(main.app)
+
+  def testResponseHasValidatorsAndCachePolicy(self):
+    response = self._Get()
+    self.assertEqual(200, response.status_int)
+    self.assertIn('rooms-us.example.com', response.body)
+    self.assertTrue(response.headers['ETag'].startswith('"'))
+    self.assertEqual('private, max-age=%d' % main._CONFIG['config_max_age'],
+                     response.headers['Cache-Control'])
+    self.assertEqual('X-AppEngine-Country, Cookie', response.headers['Vary'])
+
+  def testPayloadIsServedCompressedWhenAccepted(self):
+    # Enough regions to take the payload past compression.MIN_SIZE.
+    for i in range(20):
+      country_servers.RegionalRoomServer(
+          name='region-%d' % i, hostname='rooms-%d.example.com' % i).put()
+    # Compression is left to the front end unless the app config asks.
+    response = self._Get({'Accept-Encoding': 'gzip'})
+    self.assertNotIn('Content-Encoding', response.headers)
+    _CompressResponses(self)
+    plain = self._Get()
+    self.assertNotIn('Content-Encoding', plain.headers)
+    response = self._Get({'Accept-Encoding': 'gzip, deflate'})
+    self.assertEqual('gzip', response.headers['Content-Encoding'])
+    self.assertEqual(plain.body,
+                     zlib.decompress(response.body, 16 + zlib.MAX_WBITS))
+    self.assertNotEqual(plain.headers['ETag'], response.headers['ETag'])
+    etag = response.headers['ETag']
+    response = self._Get({'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+    self.assertEqual(304, response.status_int)
+
+  def testMatchingIfNoneMatchReturnsEmpty304(self):
+    etag = self._Get().headers['ETag']
+    response = self._Get({'If-None-Match': etag})
+    self.assertEqual(304, response.status_int)
+    self.assertEqual('', response.body)
+    self.assertEqual(etag, response.headers['ETag'])
+
+  def testETagChangesWithDirectory(self):
+    etag = self._Get().headers['ETag']
+    country_servers.RegionalRoomServer(name='asia',
+                                       hostname='rooms-asia.example.com').put()
+    response = self._Get({'If-None-Match': etag})
+    self.assertEqual(200, response.status_int)
+    self.assertNotEqual(etag, response.headers['ETag'])
+
+  def testETagDependsOnRegion(self):
+    country_servers.RegionalRoomServer(
+        name='europe', hostname='rooms-europe.example.com').put()
+    us_etag = self._Get().headers['ETag']
+    europe_etag = self._Get({'X-AppEngine-Country': 'FR'}).headers['ETag']
+    self.assertNotEqual(us_etag, europe_etag)
+
+  def testRegionWithoutServersFallsBack(self):
+    response = self._Get({'X-AppEngine-Country': 'JP'})
+    self.assertIn('CONFIG.DEFAULT_REGION = "us"', response.body)
+
+  def testNewClientsGetAnId(self):
+    response = self._Get({'Cookie': ''})
+    self.assertIn('forest_client=',
+                  ' '.join(response.headers.getall('Set-Cookie')))
+    self.assertNotIn('forest_client=',
+                     ' '.join(self._Get().headers.getall('Set-Cookie')))
+
+  def _RegionHint(self, response):
+    """Returns the value of the region hint cookie set by response, if any."""
+    for header in response.headers.getall('Set-Cookie'):
+      cookie = Cookie.SimpleCookie(header)
+      if 'forest_region' in cookie:
+        return cookie['forest_region'].value
+    return None
+
+  def _GetWithHint(self, client_id, hint, headers=None):
+    headers = dict(headers or {})
+    headers['Cookie'] = 'forest_client=%s; forest_region=%s' % (client_id, hint)
+    return self._Get(headers)
+
+  def testReturningClientsKeepTheirRegion(self):
+    country_servers.RegionalRoomServer(
+        name='europe', hostname='rooms-europe.example.com').put()
+    hint = self._RegionHint(self._Get())
+    self.assertIsNotNone(hint)
+    self.assertEqual('us', hint.split('/', 1)[0])
+
+    country_servers.CountryRegionOverride(id='US', region='europe').put()
+    self.assertIn('DEFAULT_REGION = "europe"', self._Get().body)
+    response = self._GetWithHint('client-1', hint)
+    self.assertIn('DEFAULT_REGION = "us"', response.body)
+    self.assertIsNone(self._RegionHint(response))
+
+  def testRegionHintsAreBoundToClientAndCountry(self):
+    country_servers.RegionalRoomServer(
+        name='europe', hostname='rooms-europe.example.com').put()
+    hint = self._RegionHint(self._Get({'X-AppEngine-Country': 'FR'}))
+    self.assertEqual('europe', hint.split('/', 1)[0])
+    for response in (
+        self._GetWithHint('client-2', hint, {'X-AppEngine-Country': 'FR'}),
+        self._GetWithHint('client-1', hint),
+        self._GetWithHint('client-1', hint.replace('europe/', 'us/'))):
+      self.assertIsNotNone(self._RegionHint(response))
+
+  def testClientsAreAssignedOneHostPerRegion(self):
+    country_servers.RegionalRoomServer(name='us',
+                                       hostname='rooms-us-2.example.com').put()
+    bodies = set()
+    for i in range(50):
+      body = self._Get({'Cookie': 'forest_client=client-%d' % i},
+                       remote_addr='10.0.1.%d' % i).body
+      self.assertEqual(1, body.count('"us":'))
+      bodies.add(body)
+    self.assertEqual(2, len(bodies))
+    self.assertEqual(self._Get().body, self._Get().body)
+
+  def testRequestsAreRateLimitedPerAddress(self):
+    statuses = [self._Get().status_int for _ in range(40)]
+    self.assertEqual(200, statuses[0])
+    self.assertEqual(429, statuses[-1])
+    self.assertEqual(200, self._Get(remote_addr='10.0.0.2').status_int)
+
+class RootHandlerTest(unittest2.TestCase):
+  """Test cases for handlers.RootHandler."""
+
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_datastore_v3_stub()
+    self.testbed.init_memcache_stub()
+    self.testbed.init_user_stub()
+
+  def tearDown(self):
+    self.testbed.deactivate()
+
+  def testPageIsRenderedOnceAndServedWhole(self):
+    with open(os.path.join(os.path.dirname(main.__file__), '..',
+                           'index.html')) as f:
+      # Jinja2 drops a template's final newline.
+      index = f.read().decode('utf-8')[:-1]
+    for _ in range(2):
+      response = webob.Request.blank('/').get_response(main.app)
+      self.assertEqual(200, response.status_int)
+      self.assertEqual(index, response.unicode_body)
+
+  def testPageIsCompressedOnce(self):
+    request = webob.Request.blank('/', headers={'Accept-Encoding': 'gzip'})
+    response = request.get_response(main.app)
+    self.assertNotIn('Content-Encoding', response.headers)
+    _CompressResponses(self)
+    response = request.get_response(main.app)
+    self.assertEqual('gzip', response.headers['Content-Encoding'])
+    self.assertIn('Accept-Encoding', response.headers['Vary'])
+    self.assertEqual(webob.Request.blank('/').get_response(main.app).body,
+                     zlib.decompress(response.body, 16 + zlib.MAX_WBITS))
+
+  def testRequestsWithQueryStringsAreNotCached(self):
+    handlers.RootHandler.response_cache.Clear()
+    webob.Request.blank('/').get_response(main.app)
+    for query in ('a', 'b=1', 'utm_source=x'):
+      response = webob.Request.blank('/?' + query).get_response(main.app)
+      self.assertEqual(200, response.status_int)
+    self.assertEqual(1, len(handlers.RootHandler.response_cache._entries))
+
+
+class CspHandlerTest(unittest2.TestCase):
+  """Test cases for handlers.CspHandler."""
+
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_memcache_stub()
+    self.testbed.init_taskqueue_stub()
+    csp_reports._pending.clear()
+    _ResetRateLimits()
+
+  def tearDown(self):
+    self.testbed.deactivate()
+    csp_reports._pending.clear()
+
+  def _Post(self, body, content_type='application/csp-report', **kwargs):
+    request = webob.Request.blank('/csp', POST=body, **kwargs)
+    request.content_type = content_type
+    return request.get_response(main.app)
+
+  def testReportsAreCounted(self):
+    body = json.dumps({'csp-report': {'violated-directive': 'img-src',
+                                      'blocked-uri': 'http://a.example/i'}})
+    self.assertEqual(200, self._Post(body).status_int)
+    self.assertEqual(200, self._Post(body, 'application/json').status_int)
+    self.assertEqual({('img-src', 'http://a.example', ''): 2},
+                     csp_reports._pending)
+
+  def testOtherContentTypesAreRejected(self):
+    response = self._Post('{"csp-report": {}}', 'text/plain')
+    self.assertEqual(415, response.status_int)
+    self.assertEqual({}, csp_reports._pending)
+
+  def testOversizedReportsAreRejectedBeforeReading(self):
+    max_bytes = main._CONFIG['csp_report_max_bytes']
+    body = '{"csp-report": {"blocked-uri": "%s"}}' % ('x' * max_bytes)
+    self.assertEqual(413, self._Post(body).status_int)
+
+    request = webob.Request.blank('/csp', method='POST',
+                                  content_type='application/csp-report')
+    request.body_file_raw = _UnreadableStream()
+    request.environ['CONTENT_LENGTH'] = str(max_bytes + 1)
+    self.assertEqual(413, request.get_response(main.app).status_int)
+
+  def testMalformedReportsAreRejected(self):
+    for body in ('not json', '[]', '{"csp-report": "x"}'):
+      self.assertEqual(400, self._Post(body).status_int)
+    self.assertEqual({}, csp_reports._pending)
+
+
+class _UnreadableStream(object):
+
+  def read(self, *args):
+    raise AssertionError('the body should not have been read')
+
+
+class TimingHandlerTest(unittest2.TestCase):
+  """Test cases for handlers.TimingHandler."""
+
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_datastore_v3_stub()
+    self.testbed.init_memcache_stub()
+    self.testbed.setup_env(user_email='someone@example.com', user_id='1',
+                           user_is_admin='0', overwrite=True)
+    self.testbed.init_user_stub()
+    config_cache._local.clear()
+    _ResetRateLimits()
+
+  def tearDown(self):
+    self.testbed.deactivate()
+
+  def testSpansAreListedForAdmins(self):
+    response = webob.Request.blank('/admin/timing').get_response(main.app)
+    self.assertEqual(403, response.status_int)
+
+    self.testbed.setup_env(user_is_admin='1', overwrite=True)
+    webob.Request.blank('/config.js').get_response(main.app)
+    response = webob.Request.blank('/admin/timing').get_response(main.app)
+    self.assertEqual(200, response.status_int)
+    spans = json.loads(response.body[len(')]}\',\n'):])['spans']
+    for name in ('headers', 'handler', 'user', 'render', 'directory'):
+      self.assertGreaterEqual(spans[name]['count'], 1)
+
+
+class ProfileHandlerTest(unittest2.TestCase):
+  """Test cases for handlers.ProfileHandler."""
+
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_datastore_v3_stub()
+    self.testbed.init_memcache_stub()
+    self.testbed.setup_env(user_email='someone@example.com', user_id='1',
+                           user_is_admin='0', overwrite=True)
+    self.testbed.init_user_stub()
+    _ResetRateLimits()
+
+  def tearDown(self):
+    self.testbed.deactivate()
+
+  def _GetProfile(self):
+    response = webob.Request.blank('/admin/profile').get_response(main.app)
+    if response.status_int != 200:
+      return response.status_int
+    return json.loads(response.body[len(')]}\',\n'):])
+
+  def testTokensAndStacksAreForAdmins(self):
+    self.assertEqual(403, self._GetProfile())
+
+    self.testbed.setup_env(user_is_admin='1', overwrite=True)
+    profile = self._GetProfile()
+    self.assertIn('token', profile)
+    response = webob.Request.blank(
+        '/config.js',
+        headers={profile['header']: profile['token']}).get_response(main.app)
+    self.assertEqual(200, response.status_int)
+    self.assertGreaterEqual(self._GetProfile()['samples'], profile['samples'])
+
+
+class RttHandlerTest(unittest2.TestCase):
+  """Test cases for handlers.RttHandler."""
+
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_datastore_v3_stub()
+    self.testbed.init_memcache_stub()
+    config_cache._local.clear()
+    latency._pending.clear()
+    _ResetRateLimits()
+    country_servers.RegionalRoomServer(name='us',
+                                       hostname='rooms-us.example.com').put()
+
+  def tearDown(self):
+    self.testbed.deactivate()
+    latency._pending.clear()
+
+  def _Post(self, rtts, remote_addr='10.0.0.1'):
+    return webob.Request.blank(
+        '/rtt', POST=json.dumps({'rtts': rtts}), remote_addr=remote_addr,
+        headers={'X-AppEngine-Country': 'us'}).get_response(main.app)
+
+  def testOnlyKnownRegionsAreRecordedOncePerClient(self):
+    for remote_addr in ('10.0.0.1', '10.0.0.1', '10.0.0.2'):
+      self._Post({'us': 20, 'evil': 1}, remote_addr)
+    self.assertEqual(['us'], [region for (_, region) in latency._pending])
+    self.assertEqual(2, latency._pending[('US', 'us')].count)
+
+  def testInvalidReportsAreRejected(self):
+    for rtts in ('fast', {'us': 'fast'}, {'us': -1}):
+      response = self._Post(rtts)
+      self.assertEqual(400, response.status_int)
+      self.assertIn('invalid RTT report', response.body)
+    self.assertEqual([], latency._pending.keys())
+    self.assertEqual(200, self._Post({'us': 20}).status_int)
+
+
+class WarmupHandlerTest(unittest2.TestCase):
+  """Test cases for handlers.WarmupHandler."""
+
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_datastore_v3_stub()
+    self.testbed.init_memcache_stub()
+    config_cache._local.clear()
+
+  def tearDown(self):
+    self.testbed.deactivate()
+
+  def testWarmupSeedsAndCachesDirectory(self):
+    self.assertEqual(200, main.app.get_response('/_ah/warmup').status_int)
+    self.assertIn('directory', config_cache._local)
+    pools = config_cache._local['directory'][2]['pools']
+    self.assertIn(country_servers.default_region, pools)
+
+
+if __name__ == '__main__':
+  unittest2.main()
@@ -0,0 +1,62 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""A consistent hash ring for spreading clients across room server hosts.
+
+Each node is placed on the ring at _REPLICAS pseudo-random points and a key is
+owned by the first point clockwise of its own hash.  Adding or removing a node
+only moves the keys that node gains or loses, about 1/N of them.
+"""
+
+import bisect
+import hashlib
+import struct
+
+# Points per node; more points give a more even spread at the cost of memory.
+_REPLICAS = 100
+
+# Rings are immutable, so one is shared per distinct node list.
+_MAX_CACHED_RINGS = 64
+_rings = {}
+
+
+def _Hash(value):
+  return struct.unpack('>Q', hashlib.md5(value).digest()[:8])[0]
+
+
+class HashRing(object):
+  """Maps keys to one of a fixed set of nodes."""
+
+  def __init__(self, nodes, replicas=_REPLICAS):
+    points = sorted((_Hash('%s#%d' % (node, i)), node)
+                    for node in nodes for i in range(replicas))
+    self._hashes = [h for (h, _) in points]
+    self._nodes = [n for (_, n) in points]
+
+  def get(self, key):
+    """Returns the node owning key, or None if the ring is empty."""
+    if not self._hashes:
+      return None
+    i = bisect.bisect(self._hashes, _Hash(key)) % len(self._hashes)
+    return self._nodes[i]
+
+
+def get_ring(nodes):
+  """Returns a HashRing for nodes, reusing a previously built one if possible."""
+  nodes = tuple(sorted(nodes))
+  ring = _rings.get(nodes)
+  if ring is None:
+    if len(_rings) >= _MAX_CACHED_RINGS:
+      _rings.clear()
+    ring = _rings[nodes] = HashRing(nodes)
+  return ring
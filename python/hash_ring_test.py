@@ -0,0 +1,61 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for hash_ring."""
+
+import unittest2
+
+import hash_ring
+
+
+class HashRingTest(unittest2.TestCase):
+  """Test cases for hash_ring."""
+
+  def setUp(self):
+    self.keys = ['client-%d' % i for i in range(2000)]
+
+  def _Assign(self, nodes):
+    ring = hash_ring.HashRing(nodes)
+    return dict((key, ring.get(key)) for key in self.keys)
+
+  def testEmptyRing(self):
+    self.assertIsNone(hash_ring.HashRing([]).get('client'))
+
+  def testKeysAreSpreadEvenly(self):
+    nodes = ['a', 'b', 'c', 'd']
+    counts = dict((node, 0) for node in nodes)
+    for node in self._Assign(nodes).values():
+      counts[node] += 1
+    for count in counts.values():
+      self.assertGreater(count, len(self.keys) / len(nodes) * 0.7)
+
+  def testAddingNodeOnlyMovesItsShare(self):
+    before = self._Assign(['a', 'b', 'c', 'd'])
+    after = self._Assign(['a', 'b', 'c', 'd', 'e'])
+    moved = [key for key in self.keys if before[key] != after[key]]
+    self.assertTrue(all(after[key] == 'e' for key in moved))
+    self.assertLess(len(moved), len(self.keys) * 0.3)
+
+  def testRemovingNodeOnlyMovesItsKeys(self):
+    before = self._Assign(['a', 'b', 'c', 'd'])
+    after = self._Assign(['a', 'b', 'c'])
+    for key in self.keys:
+      if before[key] != 'd':
+        self.assertEqual(before[key], after[key])
+
+  def testRingsAreSharedPerNodeSet(self):
+    self.assertIs(hash_ring.get_ring(['b', 'a']), hash_ring.get_ring(['a', 'b']))
+
+
+if __name__ == '__main__':
+  unittest2.main()
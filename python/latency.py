@@ -0,0 +1,221 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Per-country room server latency aggregates built from client RTT probes.
+
+Clients time a request to each room server listed in /config.js and report the
+results to /rtt.  Samples are kept per (country, region) as a LatencySketch: a
+histogram with logarithmically sized buckets, from which any quantile can be
+read back with bounded relative error, and which merges by adding buckets.
+
+Only regions listed in the room server directory are counted, and only one
+report per client every _CLIENT_SAMPLE_INTERVAL seconds, so that a single
+client can neither invent regions nor move a whole country by itself.
+
+Each instance accumulates samples locally and folds them into memcache in
+batches, one entry per country.  Region selection reads the merged sketches
+through a short-lived per-instance view, so /config.js pays for at most one
+memcache get per country per _VIEW_TTL.
+"""
+
+import math
+import threading
+import time
+
+from google.appengine.api import memcache
+
+_NAMESPACE = 'rtt'
+
+# Relative width of a bucket; quantiles are accurate to within about 10%.
+_GAMMA = 1.1
+_MAX_RTT_MS = 10000
+_NUM_BUCKETS = int(math.ceil(math.log(_MAX_RTT_MS, _GAMMA))) + 1
+
+# Once a sketch holds this many samples all its buckets are halved, so old
+# measurements decay and routing follows changes in the network.
+_MAX_SAMPLES = 5000
+
+# A region needs this many samples from a country before it is considered.
+MIN_SAMPLES = 50
+
+# The quantile compared between regions.
+_SELECTION_QUANTILE = 0.75
+
+# Reports are rejected if they name more regions than this.
+_MAX_REGIONS_PER_REPORT = 10
+
+# A client's reports are counted at most once per this many seconds.
+_CLIENT_SAMPLE_INTERVAL = 10 * 60
+_CLIENT_NAMESPACE = 'rtt_clients'
+
+# Local samples are folded into memcache after this many seconds or samples,
+# whichever comes first.
+_FLUSH_INTERVAL = 10
+_FLUSH_SAMPLES = 100
+_CAS_RETRIES = 3
+_MEMCACHE_TTL = 7 * 24 * 60 * 60
+
+# How long an instance uses its view of a country's merged sketches.
+_VIEW_TTL = 60
+
+_lock = threading.Lock()
+
+# (country, region) -> LatencySketch of samples not yet in memcache.
+_pending = {}
+_pending_state = {'samples': 0, 'flushed_at': time.time()}
+
+# country -> (time loaded, {region: LatencySketch})
+_views = {}
+
+
+class LatencySketch(object):
+  """A mergeable histogram of round trip times in milliseconds."""
+
+  def __init__(self, buckets=None):
+    self.buckets = list(buckets) if buckets else [0] * _NUM_BUCKETS
+
+  @property
+  def count(self):
+    return sum(self.buckets)
+
+  def add(self, rtt_ms):
+    rtt_ms = min(max(rtt_ms, 1), _MAX_RTT_MS)
+    self.buckets[int(math.ceil(math.log(rtt_ms, _GAMMA)))] += 1
+    self._Decay()
+
+  def merge(self, other):
+    self.buckets = [a + b for (a, b) in zip(self.buckets, other.buckets)]
+    self._Decay()
+
+  def quantile(self, q):
+    """Returns the upper bound of the bucket holding the q-th quantile."""
+    rank = q * self.count
+    seen = 0
+    for (i, n) in enumerate(self.buckets):
+      seen += n
+      if n and seen >= rank:
+        return _GAMMA ** i
+    return None
+
+  def _Decay(self):
+    if self.count > _MAX_SAMPLES:
+      self.buckets = [n // 2 for n in self.buckets]
+
+
+def _NormalizeCountry(country):
+  return country.upper()
+
+
+def validate_rtts(rtts, regions):
+  """Returns rtts as a {region: milliseconds} dict, or raises ValueError.
+
+  Regions which are not in regions are left out.
+  """
+  if not isinstance(rtts, dict) or len(rtts) > _MAX_REGIONS_PER_REPORT:
+    raise ValueError('rtts must be an object with at most %d entries' %
+                     _MAX_REGIONS_PER_REPORT)
+  cleaned = {}
+  for (region, rtt) in rtts.iteritems():
+    if not isinstance(region, basestring) or not 0 < len(region) <= 32:
+      raise ValueError('invalid region name')
+    if (isinstance(rtt, bool) or not isinstance(rtt, (int, long, float)) or
+        not 0 < rtt <= _MAX_RTT_MS):
+      raise ValueError('invalid RTT for region %s' % region)
+    if region in regions:
+      cleaned[str(region)] = rtt
+  return cleaned
+
+
+def _FirstSampleInInterval(client):
+  # memcache.add only succeeds for the first report in the interval.  While
+  # memcache is unavailable it fails too, and reports are dropped.
+  return memcache.add(client, 1, time=_CLIENT_SAMPLE_INTERVAL,
+                      namespace=_CLIENT_NAMESPACE)
+
+
+def record(country, rtts, client):
+  """Records one client's {region: milliseconds} measurements.
+
+  client identifies where the report came from; nothing is recorded if that
+  client was already counted in this interval.
+  """
+  if not rtts or not _FirstSampleInInterval(client):
+    return
+  country = _NormalizeCountry(country)
+  with _lock:
+    for (region, rtt) in rtts.iteritems():
+      _pending.setdefault((country, region), LatencySketch()).add(rtt)
+    _pending_state['samples'] += len(rtts)
+    now = time.time()
+    if (_pending_state['samples'] < _FLUSH_SAMPLES and
+        now - _pending_state['flushed_at'] < _FLUSH_INTERVAL):
+      return
+    pending = dict(_pending)
+    _pending.clear()
+    _pending_state['samples'] = 0
+    _pending_state['flushed_at'] = now
+  _Flush(pending)
+
+
+def _Flush(pending):
+  """Merges pending sketches into the shared per-country entries."""
+  by_country = {}
+  for ((country, region), sketch) in pending.iteritems():
+    by_country.setdefault(country, {})[region] = sketch
+
+  client = memcache.Client()
+  for (country, sketches) in by_country.iteritems():
+    for _ in range(_CAS_RETRIES):
+      stored = client.gets(country, namespace=_NAMESPACE)
+      if stored is None:
+        value = dict((r, s.buckets) for (r, s) in sketches.iteritems())
+        if client.add(country, value, time=_MEMCACHE_TTL,
+                      namespace=_NAMESPACE):
+          break
+        continue
+      for (region, sketch) in sketches.iteritems():
+        merged = LatencySketch(stored.get(region))
+        merged.merge(sketch)
+        stored[region] = merged.buckets
+      if client.cas(country, stored, time=_MEMCACHE_TTL, namespace=_NAMESPACE):
+        break
+    # Samples that still could not be merged are dropped; they are only ever
+    # a small fraction of a busy country's traffic.
+
+
+def _GetView(country):
+  now = time.time()
+  view = _views.get(country)
+  if view and now - view[0] < _VIEW_TTL:
+    return view[1]
+  stored = memcache.get(country, namespace=_NAMESPACE) or {}
+  sketches = dict((r, LatencySketch(b)) for (r, b) in stored.iteritems())
+  _views[country] = (now, sketches)
+  return sketches
+
+
+def best_region(country):
+  """Returns the region with the lowest measured latency for country.
+
+  Returns None when no region has at least MIN_SAMPLES samples from country,
+  in which case callers should fall back to the static country table.
+  """
+  if not country:
+    return None
+  country = _NormalizeCountry(country)
+  candidates = [(sketch.quantile(_SELECTION_QUANTILE), region)
+                for (region, sketch) in _GetView(country).iteritems()
+                if sketch.count >= MIN_SAMPLES]
+  if not candidates:
+    return None
+  return min(candidates)[1]
@@ -0,0 +1,117 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for latency."""
+
+import unittest2
+
+import latency
+
+from google.appengine.ext import testbed
+
+
+class LatencySketchTest(unittest2.TestCase):
+  """Test cases for latency.LatencySketch."""
+
+  def testQuantilesHaveBoundedRelativeError(self):
+    sketch = latency.LatencySketch()
+    for rtt in range(1, 1001):
+      sketch.add(rtt)
+    self.assertEqual(1000, sketch.count)
+    for (q, expected) in ((0.5, 500), (0.9, 900), (0.99, 990)):
+      value = sketch.quantile(q)
+      self.assertLessEqual(expected, value)
+      self.assertLess(value, expected * latency._GAMMA)
+
+  def testMergeAddsBuckets(self):
+    a = latency.LatencySketch()
+    b = latency.LatencySketch()
+    a.add(10)
+    b.add(10)
+    b.add(1000)
+    a.merge(b)
+    self.assertEqual(3, a.count)
+    self.assertLess(a.quantile(0.5), 20)
+    self.assertGreater(a.quantile(1.0), 900)
+
+  def testOutOfRangeValuesAreClamped(self):
+    sketch = latency.LatencySketch()
+    sketch.add(0.01)
+    sketch.add(10 ** 9)
+    self.assertEqual(2, sketch.count)
+
+  def testOldSamplesDecay(self):
+    sketch = latency.LatencySketch()
+    for _ in range(latency._MAX_SAMPLES + 1):
+      sketch.add(100)
+    self.assertLessEqual(sketch.count, latency._MAX_SAMPLES)
+
+
+class LatencyTest(unittest2.TestCase):
+  """Test cases for recording samples and selecting regions."""
+
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_memcache_stub()
+    latency._pending.clear()
+    latency._views.clear()
+    self.clients = 0
+
+  def tearDown(self):
+    self.testbed.deactivate()
+
+  def _Record(self, country, rtts, times):
+    for _ in range(times):
+      self.clients += 1
+      latency.record(country, rtts, 'client-%d' % self.clients)
+    latency._Flush(dict(latency._pending))
+    latency._pending.clear()
+
+  def testValidateRtts(self):
+    regions = {'us': ['rooms-us.example.com']}
+    self.assertEqual({'us': 10}, latency.validate_rtts({u'us': 10}, regions))
+    self.assertEqual({'us': 10},
+                     latency.validate_rtts({'us': 10, 'evil': 1}, regions))
+    for bad in ([], {'us': -1}, {'us': 'fast'}, {'us': True}, {'': 10},
+                dict(('r%d' % i, 1) for i in range(20))):
+      self.assertRaises(ValueError, latency.validate_rtts, bad, regions)
+
+  def testClientsAreCountedOncePerInterval(self):
+    for _ in range(latency.MIN_SAMPLES):
+      latency.record('TR', {'asia': 40}, '10.0.0.1')
+    self.assertEqual(1, latency._pending[('TR', 'asia')].count)
+
+  def testNoSelectionWithoutEnoughSamples(self):
+    self._Record('TR', {'europe': 40, 'asia': 90}, latency.MIN_SAMPLES - 1)
+    self.assertIsNone(latency.best_region('TR'))
+    self.assertIsNone(latency.best_region(None))
+
+  def testFastestRegionIsSelected(self):
+    self._Record('TR', {'europe': 90, 'asia': 40}, latency.MIN_SAMPLES)
+    self.assertEqual('asia', latency.best_region('TR'))
+
+  def testCountriesAreNormalized(self):
+    self._Record('tr', {'europe': 90, 'asia': 40}, latency.MIN_SAMPLES)
+    self.assertEqual('asia', latency.best_region('TR'))
+    self.assertEqual('asia', latency.best_region('tr'))
+
+  def testFlushesFromSeveralInstancesMerge(self):
+    half = latency.MIN_SAMPLES // 2 + 1
+    self._Record('AE', {'asia': 30, 'europe': 80}, half)
+    self._Record('AE', {'asia': 30, 'europe': 80}, half)
+    self.assertEqual('asia', latency.best_region('AE'))
+
+
+if __name__ == '__main__':
+  unittest2.main()
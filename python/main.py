@@ -19,16 +19,32 @@ import webapp2
 
 import base
 import base.constants
+import base.rate_limit
 import handlers
 
+# Any route can be given a per-client request rate limit by making it a
+# base.rate_limit.RateLimitedRoute; requests over the limit get a 429.
+
 # These should all inherit from base.handlers.BaseHandler
 _UNAUTHENTICATED_ROUTES = [
     ('/', handlers.RootHandler),
-    ('/config.js', handlers.ConfigHandler)
+    # Generous, since players behind one NAT share an address.
+    base.rate_limit.RateLimitedRoute(
+        '/config.js', handlers.ConfigHandler,
+        rate_limit=base.rate_limit.RateLimit(2, burst=30)),
+    # Sent by App Engine to new instances; see inbound_services in app.yaml.
+    ('/_ah/warmup', handlers.WarmupHandler)
 ]
 
 # These should all inherit from base.handlers.BaseAjaxHandler
-_UNAUTHENTICATED_AJAX_ROUTES = [('/csp', handlers.CspHandler)]
+_UNAUTHENTICATED_AJAX_ROUTES = [
+    base.rate_limit.RateLimitedRoute(
+        '/csp', handlers.CspHandler,
+        rate_limit=base.rate_limit.RateLimit(1, burst=20)),
+    base.rate_limit.RateLimitedRoute(
+        '/rtt', handlers.RttHandler,
+        rate_limit=base.rate_limit.RateLimit(1, burst=10))
+]
 
 # These should all inherit from base.handlers.AuthenticatedHandler
 _USER_ROUTES = []
@@ -40,13 +56,23 @@ _AJAX_ROUTES = []
 _ADMIN_ROUTES = []
 
 # These should all inherit from base.handlers.AdminAjaxHandler
-_ADMIN_AJAX_ROUTES = []
+_ADMIN_AJAX_ROUTES = [
+    ('/admin/csp/violations', handlers.CspViolationsHandler),
+    ('/admin/timing', handlers.TimingHandler),
+    ('/admin/profile', handlers.ProfileHandler)
+]
 
 # These should all inherit from base.handlers.BaseCronHandler
-_CRON_ROUTES = []
+_CRON_ROUTES = [
+    ('/cron/room-servers/sweep', handlers.RoomServerSweepHandler),
+    ('/cron/xsrf/rotate', handlers.XsrfKeyRotationHandler)
+]
 
 # These should all inherit from base.handlers.BaseTaskHandler
-_TASK_ROUTES = []
+_TASK_ROUTES = [
+    ('/tasks/room-servers/heartbeat', handlers.RoomServerHeartbeatHandler),
+    ('/tasks/csp/flush', handlers.CspFlushHandler)
+]
 
 # Place global application configuration settings (e.g. settings for
 # 'webapp2_extras.sessions') here.
@@ -86,12 +112,37 @@ _TASK_ROUTES = []
 #                   name in lieu of 'Content-Security-Policy' (the default
 #                   is base.constants.DEBUG).
 #
+#   jinja2_bytecode_cache: one of base.constants.NO_BYTECODE_CACHE (default),
+#                   base.constants.MEMCACHE_BYTECODE_CACHE, or
+#                   base.constants.PRECOMPILED_BYTECODE_CACHE.  Shares compiled
+#                   Jinja2 templates between instances so that only the first
+#                   one pays for compiling them.  The precompiled cache needs
+#                   'python base/template_cache.py <templates>' to be run
+#                   from the python directory before deploying.
+#
+#   compress_responses: True or False (default).  When True, responses are
+#                   gzip (or, if the brotli module is vendored, Brotli)
+#                   compressed by the application, and bodies served from a
+#                   cache are compressed once.  Leave it off to have the App
+#                   Engine front end compress responses, as it does by
+#                   default; it manages the Content-Encoding header itself.
+#
+#   server_timing: True or False (default is base.constants.DEBUG).  When True,
+#                   responses carry a Server-Timing header with the
+#                   base.timing spans of their request.
+#
+#   profile_sample_rate: The fraction of requests to profile, from 0 (the
+#                   default) to 1.  Requests sent with a token from
+#                   /admin/profile in the base.handlers.PROFILER_TOKEN_HEADER
+#                   header are profiled as well.
+#
 #  Note that the default values are also configured in app.yaml for files
 #  served via the /static/ resources.  You may need to change the settings
 #  there as well.
 
 _CONFIG = {
     'template': base.constants.JINJA2,
+    'jinja2_bytecode_cache': base.constants.MEMCACHE_BYTECODE_CACHE,
     # Developers are encouraged to build sites that comply with this CSP policy.
     # Changing the first two entries (nonce, strict-dynamic) of the script-src
     # directive may render XSS protection invalid! For more information take a
@@ -116,7 +167,13 @@ _CONFIG = {
                       'https: http:',
         'report-uri': '/csp',
         'reportOnly': base.constants.DEBUG,
-    }
+    },
+    # How long browsers may reuse /config.js before revalidating it with
+    # If-None-Match, in seconds.
+    'config_max_age': 300,
+    # Larger CSP reports are rejected with a 413 before they are read, in
+    # bytes.
+    'csp_report_max_bytes': 8 * 1024,
 }
 
 #################################